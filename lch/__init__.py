@@ -1 +1,10 @@
 from .core import *
+
+def __getattr__(name):
+    # things lch.core only loads when asked for, see lch.core._lazy
+    from . import core
+    return getattr(core, name)
+
+def __dir__():
+    from . import core
+    return sorted(set(globals()) | set(dir(core)))
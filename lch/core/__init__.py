@@ -1,10 +1,36 @@
 from .utils import *
 from .actions import *
+from .events import *
+from .dice import *
 from .terrain import *
 from .weapon import *
+from .damage import *
 from .model import *
 from .ai import *
+from .mcts import *
 from .team import *
 from .battlefield import *
 from .game import *
-from .ui import *
+from .replay import *
+from .weights import *
+from .jobs import *
+from .tournament import *
+from .workqueue import *
+from .metrics import *
+from .ratings import *
+
+# Loaded the first time they're asked for: the UI needs tkinter, which a
+# headless run never does, and db_conn opens cache.db
+_lazy = {
+        'UI': 'ui',
+        'db_conn': 'utils',
+        }
+
+def __getattr__(name):
+    if (module := _lazy.get(name)) is not None:
+        import importlib
+        return getattr(importlib.import_module(f'{__name__}.{module}'), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy))
@@ -1,9 +1,13 @@
 import lch
 from math import sqrt
-from scipy.stats import norm
 
 __all__ = 'Action NoAction MoveAction AttackAction MeleeAction ShootAction SnapShotAction ChargeAction'.split()
 
+def norm_sf(x, loc, scale):
+    # scipy.stats takes most of a second to import, so it waits until it's needed
+    from scipy.stats import norm
+    return norm.sf(x, loc=loc, scale=scale)
+
 def chance_to_hit_ranged(attacker, defender, obstruction=0, move_dist=0, shot_dist=0):
     """
     Chance for an attacker to hit a defender at range
@@ -17,25 +21,23 @@ def chance_to_hit_ranged(attacker, defender, obstruction=0, move_dist=0, shot_di
     if penalty is None:
         return 0
     penalty = sum(penalty)
-    return norm.sf(defender.dodge, loc=attacker.rs-penalty*attacker.rc, scale=attacker.rc)
+    return norm_sf(defender.dodge, loc=attacker.rs-penalty*attacker.rc, scale=attacker.rc)
 
-def chance_to_hit_melee(attacker, defender, charged=False, n_trials = 1000):
+def chance_to_hit_melee(attacker, defender, charged=False):
     """
-    Chance for an attacker to hit a defender in melee combat. No closed-form
-    expression so just runs 1000 mock trials
+    Chance for an attacker to hit a defender in melee combat. Both sides roll
+    a normal distribution, so the difference is also normal and we don't need
+    to simulate anything (which would also draw from a global random state)
     :param attacker: a Model
     :param defender: a Model
     :param charged: bool, did the attacker charge into this combat
-    :param n_trials: how many trials to simulate. Default 1000
-    :returns: float, approx chance to hit
+    :returns: float, chance to hit
     """
     a_consistency = attacker.mc
     a_skill = attacker.ms + (0 if not charged else a_consistency)
     d_skill = defender.ms
     d_consistency = defender.mc
-    a = norm.rvs(loc=a_skill, scale=a_consistency, size=n_trials)
-    d = norm.rvs(loc=d_skill, scale=d_consistency, size=n_trials)
-    return (a > d).sum()/n_trials
+    return norm_sf(0, loc=a_skill-d_skill, scale=sqrt(a_consistency**2 + d_consistency**2))
 
 class Action(object):
     """
@@ -1,12 +1,13 @@
 import lch
+import copy
 import numpy as np
 import io
 
-__all__ = 'AI Random DenseMultilayer'.split()
+__all__ = 'AI Random DenseMultilayer QuantizedDenseMultilayer quantization_agreement'.split()
 
-def rand(shape, _min=-2, _max=-2):
-    # a wrapper abound np.random.random
-    return (_max - _min)*np.random.random(size=shape) + _min
+def rand(shape, _min=-1, _max=1, rng=None):
+    # a wrapper abound Generator.random
+    return (_max - _min)*lch.get_rng(rng).random(size=shape) + _min
 
 class AI(object):
     """
@@ -62,19 +63,33 @@ class AI(object):
             ('e_threat_rw_max_dmg', np.float32),
             ]
 
-    def __init__(self, _hash=None, parent_hash=None, **kwargs):
+    def __init__(self, _hash=None, parent_hash=None, rng=None, **kwargs):
+        """
+        :param _hash: str, the hash if already known
+        :param parent_hash: str, the hash of the AI this one mutated from
+        :param rng: a np.random.Generator or seed, see lch.get_rng
+        :param **kwargs: the values of self.fields()
+        """
+        self.rng = lch.get_rng(rng)
         for k in self.fields():
             setattr(self, k, kwargs[k])
 
-        self.hash = _hash or lch.get_hash(*[
-            kwargs[k].tobytes().hex()
-            if isinstance(kwargs[k], np.ndarray) else kwargs[k]
-            for k in self.fields()])
+        self.hash = _hash or lch.get_hash(*[kwargs[k] for k in self.fields()])
         self.parent_hash = parent_hash or '0'*6
 
     def __eq__(self, rhs):
         return self.hash == rhs.hash
 
+    def fork(self, rng=None):
+        """
+        A copy that shares this AI's weights but has its own random stream, for
+        playing more than one game with the same decoded AI
+        :param rng: a np.random.Generator or seed, see lch.get_rng
+        """
+        ret = copy.copy(self)
+        ret.rng = lch.get_rng(rng)
+        return ret
+
     @staticmethod
     def create_table(conn):
         try:
@@ -85,6 +100,7 @@ class AI(object):
                 'binary BLOB );')
         except Exception as e:
             pass
+        lch.forget_columns('ai')
 
     @classmethod
     def base_fields(cls):
@@ -101,12 +117,12 @@ class AI(object):
         return self.base_fields()
 
     @staticmethod
-    def from_hash(_hash):
+    def from_hash(_hash, rng=None):
         args = lch.load_from_cache('ai', _hash)
-        return getattr(lch, args[2]).from_tuple(args)
+        return getattr(lch, args[2]).from_tuple(args, rng=rng)
 
     @classmethod
-    def from_tuple(cls, args):
+    def from_tuple(cls, args, rng=None):
         """
         The opposite of encode - generates a new *AI from the tuple
         stored in the database
@@ -115,7 +131,7 @@ class AI(object):
         with io.BytesIO(blob) as f:
             data = np.load(f)
             fields = data['fields']
-            return cls(_hash = _hash, parent_hash=parent_hash,
+            return cls(_hash = _hash, parent_hash=parent_hash, rng=rng,
                     **{k: data[k] for k in fields})
 
     def encode(self):
@@ -136,23 +152,37 @@ class AI(object):
         :param prob: the probability that any one value changes, default 0.5
         :returns: a new *AI
         """
-        kwargs = {}
+        return self.mutate_batch(1, step=step, prob=prob)[0]
+
+    def mutate_batch(self, n, step=0.1, prob=0.5):
+        """
+        Mutate into many children at once. Each field is mutated for all children
+        in one step as a stacked array with the children along the first axis,
+        and each child gets a view of its slice
+        :param n: how many children
+        :param step: how much to change parameters by, default 0.1
+        :param prob: the probability that any one value changes, default 0.5
+        :returns: list of n new *AIs
+        """
+        stacked = {}
         for k in self.fields():
             x = getattr(self, k)
             if isinstance(x, np.ndarray) and x.dtype == float:
                 # most parameters here
-                mask = np.random.random(size=x.shape) > prob
-                kwargs[k] = x + mask * step * rand(x.shape)
+                shape = (n, *x.shape)
+                mask = self.rng.random(size=shape) > prob
+                stacked[k] = x + mask * step * rand(shape, rng=self.rng)
             elif isinstance(x, int) or (isinstance(x, np.ndarray) and x.dtype == int):
                 # things like top_n here
                 c = [0,1] if x == 1 else [-1, 0, 1]
                 p = [1-step, step] if x == 1 else [step, 1-2*step, step]
-                kwargs[k] = x + np.random.choice(c, p=p)
+                stacked[k] = x + self.rng.choice(c, p=p, size=n)
             else:
                 # no change till I figure this out
-                kwargs[k] = x
+                stacked[k] = [x]*n
 
-        return self.__class__(parent_hash = self.hash, **kwargs)
+        return [self.__class__(parent_hash = self.hash, rng=self.rng,
+            **{k: v[i] for k,v in stacked.items()}) for i in range(n)]
 
     def normalize_input(self, actions):
         """
@@ -223,6 +253,15 @@ class AI(object):
         """
         raise NotImplementedError()
 
+    def process_batch(self, normed):
+        """
+        Run a batch of normalized inputs through the NN
+        :param normed: array with shape (n_actions, len(dtype)), as from normalize_input
+        :returns: array of n_actions scores
+        """
+        return np.array([self.process_one(a.reshape((len(self.dtype), 1))).item()
+            for a in normed])
+
     def select_action(self, actions):
         """
         Selects from the provided actions via ML magicks
@@ -231,13 +270,19 @@ class AI(object):
         """
         if len(actions) == 0:
             return lch.NoAction()
-        normed = self.normalize_input(actions)
-        prob = np.zeros(len(normed))
-        for i,a in enumerate(normed):
-            prob[i] = self.process_one(a.reshape((len(self.dtype), 1)))
+        return actions[self.pick(self.process_batch(self.normalize_input(actions)))]
+
+    def pick(self, prob):
+        """
+        Choose an action given its score from the NN
+        :param prob: array of scores, one per action
+        :returns: int, the index of the chosen action
+        """
         if self.top_n is None or self.top_n == 1:
             best_i = np.argmax(prob)
         else:
+            # scores come out of a tanh, weights for the choice can't be negative
+            prob = (prob + 1)/2
             n = min(self.top_n, len(prob))
             cutoff = np.sort(prob)[-n]
             prob[(prob < cutoff) | np.isnan(prob)] = 0
@@ -246,8 +291,8 @@ class AI(object):
                 p = np.ones(len(prob))/len(prob)
             else:
                 p = prob/s
-            best_i = np.random.choice(len(prob), p=p)
-        return actions[best_i]
+            best_i = self.rng.choice(len(prob), p=p)
+        return best_i
 
     def take_enemy_action(self, action):
         """
@@ -264,7 +309,7 @@ class Random(AI):
         return []
 
     def select_action(self, actions):
-        return actions[np.random.choice(len(actions))]
+        return actions[self.rng.choice(len(actions))]
 
 class DenseMultilayer(AI):
     """
@@ -273,22 +318,24 @@ class DenseMultilayer(AI):
     hidden_nodes = [64, 16]
 
     @classmethod
-    def from_scratch(cls, **kwargs):
+    def from_scratch(cls, rng=None, **kwargs):
         """
         Returns a new AI with random parameters
+        :param rng: a np.random.Generator or seed, see lch.get_rng
         """
+        rng = lch.get_rng(rng)
         output_shape = kwargs.get('output_shape', 1)
         input_shape = kwargs.get('input_shape', len(cls.dtype))
         kwargs = {
-                'top_n': np.random.randint(3,6),
-                'oc': rand((1, cls.hidden_nodes[-1])),
-                'ob': rand((output_shape, 1)),
+                'top_n': int(rng.integers(3,6)),
+                'oc': rand((1, cls.hidden_nodes[-1]), rng=rng),
+                'ob': rand((output_shape, 1), rng=rng),
         }
         for i, v in enumerate(cls.hidden_nodes):
             cols = input_shape if i == 0 else cls.hidden_nodes[i-1]
-            kwargs[f'hc_{i}'] = rand((v, cols))
-            kwargs[f'hb_{i}'] = rand((v, 1))
-        return cls(**kwargs)
+            kwargs[f'hc_{i}'] = rand((v, cols), rng=rng)
+            kwargs[f'hb_{i}'] = rand((v, 1), rng=rng)
+        return cls(rng=rng, **kwargs)
 
     def fields(self):
         n = range(len(self.hidden_nodes))
@@ -304,6 +351,114 @@ class DenseMultilayer(AI):
         output = activation_funcs['tanh'](np.add(output, self.ob, out=output))
         return output
 
+    def process_batch(self, normed):
+        hidden = normed.T
+        for i in range(len(self.hidden_nodes)):
+            hidden = getattr(self, f'hc_{i}') @ hidden
+            hidden = activation_funcs['leaky_relu'](np.add(hidden, getattr(self, f'hb_{i}'), out=hidden))
+
+        output = self.oc @ hidden
+        output = activation_funcs['tanh'](np.add(output, self.ob, out=output))
+        return output[0]
+
+    def quantize(self, mode='int8'):
+        """
+        Make a reduced-precision copy of this AI for inference
+        :param mode: 'float16' or 'int8'. int8 uses a scale per row of each
+            connection matrix. Default 'int8'
+        :returns: a QuantizedDenseMultilayer with the same hash
+        """
+        n = range(len(self.hidden_nodes))
+        kwargs = {'top_n': self.top_n, 'ob': self.ob.astype(np.float32)}
+        kwargs['oc'], kwargs['oc_scale'] = QuantizedDenseMultilayer.quantize_matrix(self.oc, mode)
+        for i in n:
+            kwargs[f'hc_{i}'], kwargs[f'hc_{i}_scale'] = QuantizedDenseMultilayer.quantize_matrix(
+                    getattr(self, f'hc_{i}'), mode)
+            kwargs[f'hb_{i}'] = getattr(self, f'hb_{i}').astype(np.float32)
+        return QuantizedDenseMultilayer(mode=mode, _hash=self.hash,
+                parent_hash=self.parent_hash, rng=self.rng, **kwargs)
+
+class QuantizedDenseMultilayer(DenseMultilayer):
+    """
+    Inference-only DenseMultilayer with the connection matrices stored in float16,
+    or in int8 with a float32 scale per row. Computation happens in float32.
+    Make one with DenseMultilayer.quantize
+    """
+    def __init__(self, mode='int8', **kwargs):
+        self.mode = mode
+        super().__init__(**kwargs)
+
+    def fields(self):
+        n = range(len(self.hidden_nodes))
+        return super().fields() + ['oc_scale'] + [f'hc_{i}_scale' for i in n]
+
+    @staticmethod
+    def quantize_matrix(x, mode):
+        """
+        Quantize one connection matrix
+        :param x: 2d float array
+        :param mode: 'float16' or 'int8'
+        :returns: (quantized array, per-row scale array or None)
+        """
+        if mode == 'float16':
+            return x.astype(np.float16), None
+        if mode == 'int8':
+            scale = np.abs(x).max(axis=1, keepdims=True)/127
+            scale[scale == 0] = 1
+            return np.round(x/scale).astype(np.int8), scale.astype(np.float32)
+        raise ValueError(f'Invalid quantization mode: {mode}, must be float16 or int8')
+
+    @staticmethod
+    def dense(c, scale, x):
+        """
+        c @ x, undoing the quantization
+        """
+        out = c.astype(np.float32) @ x
+        if scale is not None:
+            out = np.multiply(out, scale, out=out)
+        return out
+
+    def process_one(self, a):
+        hidden = a.astype(np.float32)
+        for i in range(len(self.hidden_nodes)):
+            hidden = self.dense(getattr(self, f'hc_{i}'), getattr(self, f'hc_{i}_scale'), hidden)
+            hidden = activation_funcs['leaky_relu'](np.add(hidden, getattr(self, f'hb_{i}'), out=hidden))
+
+        output = self.dense(self.oc, self.oc_scale, hidden)
+        output = activation_funcs['tanh'](np.add(output, self.ob, out=output))
+        return output
+
+    def process_batch(self, normed):
+        return self.process_one(normed.T)[0]
+
+    def quantize(self, mode='int8'):
+        raise TypeError("Quantized AIs can't be quantized again, quantize the float DenseMultilayer instead")
+
+    def encode(self):
+        raise TypeError('Quantized AIs are for inference only, encode the float DenseMultilayer instead')
+
+    def mutate_batch(self, *args, **kwargs):
+        raise TypeError('Quantized AIs are for inference only, mutate the float DenseMultilayer instead')
+
+def quantization_agreement(ai, inputs, mode='int8'):
+    """
+    How often does quantizing an AI change the action it would pick?
+    :param ai: a DenseMultilayer
+    :param inputs: iterable of arrays of normalized actions, as returned by
+        AI.normalize_input, one per decision
+    :param mode: the quantization mode, see DenseMultilayer.quantize
+    :returns: (fraction of decisions where the best action is unchanged,
+        largest absolute change in any action's score)
+    """
+    q = ai.quantize(mode)
+    same, total, max_err = 0, 0, 0
+    for normed in inputs:
+        full, quant = ai.process_batch(normed), q.process_batch(normed)
+        same += int(np.argmax(full) == np.argmax(quant))
+        total += 1
+        max_err = max(max_err, float(np.max(np.abs(full - quant))))
+    return same/max(total, 1), max_err
+
 def Recurrent(AI):
     """
     Now with some memory. Keeps track of own and enemies' actions
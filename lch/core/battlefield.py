@@ -2,7 +2,6 @@ import lch
 from math import sqrt, sin, cos, atan2, pi
 import typing as ty
 import itertools
-import tqdm
 
 __all__ = 'Battlefield'.split()
 
@@ -0,0 +1,140 @@
+import lch
+import numpy as np
+from math import comb
+
+__all__ = 'DamageTable damage_table matchup_tables'.split()
+
+class DamageTable(object):
+    """
+    The exact outcome of landing some hits with one weapon on a defender with a
+    given armor, the same thing Game.do_damage samples. For every number of hits
+    and every starting health we have the distribution of health left over, from
+    which come the kill chance and the expected damage. Weapons whose damage
+    falls off with distance (Shotguns) get one table per distance bin, the rest
+    have a single bin that applies at every distance
+    """
+    bin_width = 1
+
+    def __init__(self, weapon, armor, max_health):
+        """
+        :param weapon: a Weapon
+        :param armor: int, the defender's armor
+        :param max_health: int, the most health the defender can have
+        """
+        self.weapon_hash = weapon.hash
+        self.armor = armor
+        self.max_hits = weapon.attacks
+        self.max_health = max_health
+        if weapon.falloff:
+            n_bins = int(np.ceil(weapon.range/self.bin_width)) + 1
+            distances = (np.arange(n_bins) + 0.5)*self.bin_width
+        else:
+            distances = [0]
+        effective_armor = max(armor - weapon.punch, 0)
+        # remaining[bin, hits, health, health left]
+        self.remaining = np.stack([
+            self.propagate(self.transition(weapon.damage_pmf(d), effective_armor))
+            for d in distances])
+        self.kill = self.remaining[..., 0]
+        left = self.remaining @ np.arange(max_health + 1)
+        self.expected_damage = np.arange(max_health + 1) - left
+
+    def transition(self, pmf, effective_armor):
+        """
+        :param pmf: array, the distribution of damage per hit before armor
+        :param effective_armor: int, armor after punch
+        :returns: (health+1, health+1) array, the chance one hit takes a model
+            from one health to another. Dead models stay dead
+        """
+        dealt = np.zeros(max(len(pmf) - effective_armor, 1))
+        for d, p in enumerate(pmf):
+            dealt[max(d - effective_armor, 0)] += p
+        h = np.arange(self.max_health + 1)
+        ret = np.zeros((len(h), len(h)))
+        ret[0, 0] = 1
+        for d, p in enumerate(dealt):
+            ret[h[1:], np.maximum(h[1:] - d, 0)] += p
+        return ret
+
+    def propagate(self, transition):
+        """
+        :returns: (hits+1, health+1, health+1) array of the distribution of health
+            left after that many hits
+        """
+        ret = np.empty((self.max_hits + 1, self.max_health + 1, self.max_health + 1))
+        ret[0] = np.eye(self.max_health + 1)
+        for k in range(1, self.max_hits + 1):
+            ret[k] = ret[k-1] @ transition
+        return ret
+
+    def bin(self, distance):
+        """
+        :param distance: float, how far away the shot came from
+        :returns: int, which distance bin applies
+        """
+        n_bins = len(self.remaining)
+        return min(int(distance/self.bin_width), n_bins - 1)
+
+    def kill_chance(self, hits, health, distance=0):
+        """
+        :param hits: int, how many hits land
+        :param health: int, the defender's current health
+        :param distance: float, how far away the attacker is, default 0
+        :returns: float, the chance the defender dies
+        """
+        return self.kill[self.bin(distance), hits, health]
+
+    def damage(self, hits, health, distance=0):
+        """
+        Arguments as for kill_chance
+        :returns: float, the expected damage, which can't be more than health
+        """
+        return self.expected_damage[self.bin(distance), hits, health]
+
+    def attack(self, hit_chance, health, distance=0):
+        """
+        The outcome of a whole attack, where each of the weapon's attacks hits
+        independently
+        :param hit_chance: float, the chance each attack hits
+        :param health: int, the defender's current health
+        :param distance: float, how far away the attacker is, default 0
+        :returns: (kill chance, expected damage)
+        """
+        n = self.max_hits
+        hits = np.array([comb(n, k)*hit_chance**k*(1-hit_chance)**(n-k) for k in range(n+1)])
+        b = self.bin(distance)
+        return (float(hits @ self.kill[b, :, health]),
+                float(hits @ self.expected_damage[b, :, health]))
+
+table_cache = {}
+matchup_cache = {}
+
+def damage_table(weapon, armor, max_health):
+    """
+    A DamageTable, built only the first time it's needed
+    """
+    key = (weapon.hash, armor, max_health)
+    if (ret := table_cache.get(key)) is None:
+        ret = table_cache[key] = DamageTable(weapon, armor, max_health)
+    return ret
+
+def matchup_tables(team_a, team_b):
+    """
+    Every table a game between these teams can need, both ways around
+    :param team_a: a Team
+    :param team_b: a Team
+    :returns: dict of {(attacker game_hash, 'rw' or 'mw', defender game_hash): DamageTable}
+    """
+    key = (team_a.hash, team_b.hash)
+    if (ret := matchup_cache.get(key)) is not None:
+        return ret
+    ret = {}
+    for attackers, defenders in [(team_a, team_b), (team_b, team_a)]:
+        for attacker in attackers.models:
+            for kind in ['rw', 'mw']:
+                weapon = getattr(attacker, kind)
+                for defender in defenders.models:
+                    ret[(attacker.game_hash, kind, defender.game_hash)] = damage_table(
+                            weapon, defender.armor, defender.max_health)
+    matchup_cache[key] = matchup_cache[(team_b.hash, team_a.hash)] = ret
+    return ret
@@ -0,0 +1,63 @@
+import lch
+import numpy as np
+
+__all__ = 'Dice'.split()
+
+class Dice(object):
+    """
+    Combat only ever needs a handful of random numbers at a time, and asking
+    scipy or even a Generator for them one small array at a time is mostly
+    overhead. This draws standard normals and uniforms in big blocks and hands
+    out rescaled slices. Has the same signatures as the Generator methods it
+    replaces, so it can be passed anywhere one of those is expected
+    """
+    def __init__(self, rng=None, block_size=4096):
+        """
+        :param rng: a np.random.Generator or seed, see lch.get_rng
+        :param block_size: how many of each kind to draw at once, default 4096
+        """
+        self.rng = lch.get_rng(rng)
+        self.block_size = block_size
+        self.normals = np.empty(0)
+        self.normal_i = 0
+        self.uniforms = np.empty(0)
+        self.uniform_i = 0
+
+    def standard_normal(self, size):
+        """
+        :param size: int, how many
+        :returns: array of standard normals
+        """
+        if self.normal_i + size > len(self.normals):
+            self.normals = self.rng.standard_normal(max(self.block_size, size))
+            self.normal_i = 0
+        ret = self.normals[self.normal_i:self.normal_i+size]
+        self.normal_i += size
+        return ret
+
+    def random(self, size):
+        """
+        :param size: int, how many
+        :returns: array of uniforms in [0, 1)
+        """
+        if self.uniform_i + size > len(self.uniforms):
+            self.uniforms = self.rng.random(max(self.block_size, size))
+            self.uniform_i = 0
+        ret = self.uniforms[self.uniform_i:self.uniform_i+size]
+        self.uniform_i += size
+        return ret
+
+    def normal(self, loc=0., scale=1., size=None):
+        """
+        Like Generator.normal
+        """
+        ret = loc + scale*self.standard_normal(1 if size is None else size)
+        return ret[0] if size is None else ret
+
+    def integers(self, low, high, size=None, endpoint=False):
+        """
+        Like Generator.integers, except high is required
+        """
+        n = high - low + int(endpoint)
+        ret = low + (n*self.random(1 if size is None else size)).astype(np.int64)
+        return int(ret[0]) if size is None else ret
@@ -0,0 +1,152 @@
+import lch
+import collections
+import pickle
+import typing as ty
+
+__all__ = 'ActionEvent ShootEvent MeleeEvent DamageEvent EventSink NullSink PrintSink RingBufferSink FileSink read_events'.split()
+
+# Events are what the game emits instead of printing. They only hold the raw
+# values, all the string formatting happens in __str__ so it only costs
+# anything if a human-facing sink asks for it
+
+class DamageEvent(ty.NamedTuple):
+    defender: str
+    damage: tuple
+    killed: bool
+
+    def __str__(self):
+        if self.killed:
+            return f'killed {self.defender}'
+        return f'Did {"/".join(map(str, self.damage))} to {self.defender}'
+
+class ActionEvent(ty.NamedTuple):
+    action: str
+    model: str
+    start: tuple
+    move_dest: ty.Optional[tuple]
+    target: ty.Optional[str]
+
+    def __str__(self):
+        lines = [f'Engaging action for {self.model}']
+        cls = getattr(lch, self.action)
+        if self.move_dest is not None:
+            lines.append(f'Moving {self.model} from {self.start} to {self.move_dest}')
+        if issubclass(cls, lch.ShootAction):
+            lines.append(f'{self.model} shooting at {self.target}')
+        elif issubclass(cls, lch.MeleeAction):
+            lines.append(f'{self.model} stabbing {self.target}')
+        return '\n'.join(lines)
+
+class ShootEvent(ty.NamedTuple):
+    attacker: str
+    defender: str
+    skill: int
+    consistency: int
+    penalty: ty.Optional[tuple]
+    rolls: ty.Any
+    target: float
+    hits: int
+    damage: ty.Optional[DamageEvent]
+
+    def __str__(self):
+        if self.penalty is None:
+            return "Can\'t move and shoot a heavy weapon"
+        rolls = [f'{x:.1f}' for x in self.rolls]
+        s = (f'Attack skill {self.skill}/{self.consistency}, penalty {sum(self.penalty):.2f}, '
+             f'rolls {rolls}, target {self.target:.1f}. ')
+        if self.hits == 0:
+            return s + 'No hits'
+        return s + f'{self.hits} hits, {self.damage}'
+
+class MeleeEvent(ty.NamedTuple):
+    attacker: str
+    defender: str
+    skill: int
+    consistency: int
+    defender_skill: int
+    defender_consistency: int
+    rolls: ty.Any
+    defense_rolls: ty.Any
+    hits: int
+    damage: ty.Optional[DamageEvent]
+
+    def __str__(self):
+        rolls = [f'{x:.1f}' for x in self.rolls]
+        defense_rolls = [f'{x:.1f}' for x in self.defense_rolls]
+        s = (f'Skill {self.skill}/{self.consistency} vs {self.defender_skill}/'
+             f'{self.defender_consistency}, rolls {rolls}/{defense_rolls} ')
+        if self.hits == 0:
+            return s + 'no hits'
+        return s + f'{self.hits} hits, {self.damage}'
+
+class EventSink(object):
+    """
+    Where a Game sends its events
+    """
+    def emit(self, event):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+class NullSink(EventSink):
+    """
+    For headless games where nobody is watching
+    """
+    def emit(self, event):
+        pass
+
+class PrintSink(EventSink):
+    """
+    Prints every event, the closest thing to the old behavior
+    """
+    def emit(self, event):
+        print(event)
+
+class RingBufferSink(EventSink):
+    """
+    Keeps the last few events in memory, unformatted
+    """
+    def __init__(self, maxlen=1000):
+        """
+        :param maxlen: how many events to keep, default 1000
+        """
+        self.events = collections.deque(maxlen=maxlen)
+
+    def emit(self, event):
+        self.events.append(event)
+
+    def __iter__(self):
+        return self.events.__iter__()
+
+    def __len__(self):
+        return len(self.events)
+
+class FileSink(EventSink):
+    """
+    Appends pickled events to a file, read them back with read_events
+    """
+    def __init__(self, fn):
+        """
+        :param fn: str, the file to append to
+        """
+        self.f = open(fn, 'ab')
+
+    def emit(self, event):
+        pickle.dump(event, self.f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def close(self):
+        self.f.close()
+
+def read_events(fn):
+    """
+    The reverse of FileSink
+    :param fn: str, the file written by a FileSink
+    :yields: events, in the order they were emitted
+    """
+    with open(fn, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
@@ -1,24 +1,73 @@
 import lch
-import sqlite3 as sql
 import time
-from scipy.stats import norm
+import numpy as np
 
 
-__all__ = 'Game'.split()
+__all__ = 'Game GameState'.split()
+
+STATUSES = ('ready', 'activated', 'dead')
+STATUS_CODES = {s: i for i, s in enumerate(STATUSES)}
+
+class GameState(object):
+    """
+    Everything about a Game that changes while it's played, as a few small
+    arrays. Rows are models in the order of Game.models. Get one from Game.clone
+    and go back to it with Game.restore
+    """
+    def __init__(self, coords, health, status):
+        """
+        :param coords: (n_models, 2) int16 array
+        :param health: (n_models,) int16 array, current health
+        :param status: (n_models,) int8 array, indices into STATUSES
+        """
+        self.coords = coords
+        self.health = health
+        self.status = status
+
+    def copy(self):
+        return GameState(self.coords.copy(), self.health.copy(), self.status.copy())
+
+    def __eq__(self, rhs):
+        return (np.array_equal(self.coords, rhs.coords) and
+                np.array_equal(self.health, rhs.health) and
+                np.array_equal(self.status, rhs.status))
 
 class Game(object):
     """
     The master class representing one game between two teams on one battlefield
     :param teams: an iterable containing two hashes of teams stored in the cache
-    :param ais: an iterable containing two hashes of AIs stored in the cache
+    :param ais: an iterable containing two hashes of AIs stored in the cache, or
+        already-loaded AIs, which are forked so the originals aren't touched
     :param bf: a Battlefield instance
-    :param store: bool, store a replay of this game. Default False.
+    :param store: bool or ReplayStore, where to store a replay of this game when
+        it's over. True means ReplayStore.shared(). Default False
+    :param seed: None, int, or SeedSequence. Everything random in this game
+        (dice and both AIs) is derived from this, so the same seed on the same
+        battlefield replays the same game. Default None, which means fresh entropy
+    :param sink: an EventSink for what happens during the game. Default None,
+        which prints everything. Use NullSink for headless games
     """
-    def __init__(self, teams, ais, bf, store=False):
+    def __init__(self, teams, ais, bf, store=False, seed=None, sink=None):
         self.bf = bf
+        self.sink = lch.PrintSink() if sink is None else sink
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed = seed
+        dice_seed, *ai_seeds = lch.spawn_seeds(seed, 3)
+        self.rng = lch.get_rng(dice_seed)
+        self.dice = lch.Dice(self.rng)
         self.teams = list(map(lch.Team.from_hash, teams))
         for i in range(2):
-            self.teams[i].AI = None if ais[i] is None else lch.AI.from_hash(ais[i])
+            if isinstance(ais[i], lch.AI):
+                self.teams[i].AI = ais[i].fork(lch.get_rng(ai_seeds[i]))
+            else:
+                self.teams[i].AI = None if ais[i] is None else lch.AI.from_hash(ais[i],
+                        rng=lch.get_rng(ai_seeds[i]))
+        ais = [ai.hash if isinstance(ai, lch.AI) else ai for ai in ais]
+        self.models = self.teams[0].models + self.teams[1].models
+        for team in self.teams:
+            if team.AI is not None:
+                team.AI.game = self
         for i,model in enumerate(self.teams[0].models):
             xy = (0, i)
             model.coords = xy
@@ -28,56 +77,42 @@ class Game(object):
             model.coords = xy
             self.bf.cache[xy].model = model
         self.max_turns = 12
+        self.turn_i = 0
         self.winning_team = -1
-        self.hash = lch.get_hash(bf.hash, *teams, *ais)
+        self.hash = lch.get_hash(bf.hash, *teams, *ais, seed.entropy, *seed.spawn_key)
         self.logger = lch.get_logger('game', self.hash)
         self.logger.debug(f'Game based on {bf.hash} {teams[0]} {teams[1]}')
-        self.store = store
-        # setup initial conditions
-        self.db_setup()
-        self.replay = []
-        for team in self.teams:
-            for model in team.models:
-                self.add_to_replay(0, 0, model.get_snapshot())
-
-    def __del__(self):
-        if not self.store:
-            return
-        self.connection.executemany('INSERT INTO replay VALUES (?,?,?,?,?,?,?);', self.replay)
-        self.connection.commit()
-        self.connection.close()
-
-    def db_setup(self):
-        if not self.store:
-            return
-        self.connection = sql.connect(f'games/game_{self.hash}.db')
-        self.connection.execute("""CREATE TABLE battlefield (
-            x INTEGER,
-            y INTEGER,
-            move REAL,
-            los REAL);""")
-        for row in self.bf.encode():
-            self.connection.execute('INSERT INTO battlefield VALUES (?,?,?,?);', row)
-        #lch.Team.create_table(self.connection)
-        #for t in self.teams:
-        #    args = t.encode(True)
-        #    q = ','.join('?'*len(args))
-        #    self.connection.execute(f'INSERT INTO team VALUES ({q});', args)
-        self.connection.execute("""CREATE TABLE replay (
-            turn INTEGER,
-            step INTEGER,
-            hash TEXT,
-            current_health INTEGER,
-            status TEXT,
-            x INTEGER,
-            y INTEGER);""")
-        self.connection.commit()
-
-    def add_to_replay(self, turn_i, step, snapshot):
-        self.replay.append((turn_i, step, *snapshot))
+        self.store = lch.ReplayStore.shared() if store is True else store
+        self.replay = lch.ReplayRecorder(self.models)
+        self.replay.record(0, 0, self.clone())
+
+    def clone(self):
+        """
+        Snapshot the state of the game, cheaply. Doesn't include the dice, so
+        rolling forward from a restored state gives fresh outcomes
+        :returns: GameState
+        """
+        return GameState(
+                np.array([m.coords for m in self.models], dtype=np.int16),
+                np.array([m.current_health for m in self.models], dtype=np.int16),
+                np.array([STATUS_CODES[m.status] for m in self.models], dtype=np.int8))
+
+    def restore(self, state):
+        """
+        Put the game back how it was when the state was cloned. Square.model
+        isn't touched, nothing reads it after setup
+        :param state: GameState, from clone
+        :returns: None
+        """
+        for m, (x, y), health, status in zip(self.models, state.coords.tolist(),
+                state.health.tolist(), state.status.tolist()):
+            m.coords = (x, y)
+            m.current_health = health
+            m.status = STATUSES[status]
 
     def start_of_turn(self, turn_i):
         self.logger.debug(f'Starting turn {turn_i}')
+        self.turn_i = turn_i
         for team in self.teams:
             team.ready_up()
 
@@ -91,16 +126,14 @@ class Game(object):
         return False
 
     def engage_action(self, action):
-        print(f'Engaging action for {action.model.name}')
+        self.sink.emit(lch.ActionEvent(action.__class__.__name__, action.model.name,
+            action.model.coords, action.move_dest, action.target and action.target.name))
         action.model.status = 'activated'
         if isinstance(action, lch.MoveAction):
-            print(f'Moving {action.model.name} from {action.model.coords} to {action.move_dest}')
             self.move_model(action.model, action.move_dest)
         if isinstance(action, lch.ShootAction):
-            print(f'{action.model.name} shooting at {action.target.name}')
             self.shoot_action(action)
         elif isinstance(action, lch.MeleeAction):
-            print(f'{action.model.name} stabbing {action.target.name}')
             self.melee_action(action)
 
     def move_model(self, model, destination):
@@ -112,23 +145,19 @@ class Game(object):
         :param defender: a Model
         :param weapon: the Weapon in question
         :param hits: how many times to roll damage
-        :returns: None
+        :returns: DamageEvent
         """
         effective_armor = max(defender.armor - weapon.punch, 0)
-        tot_damage = 0
         damage = []
-        for _ in range(hits):
-            damage.append(max(weapon.damage(shot_dist) - effective_armor, 0))
+        for roll in weapon.damage(shot_dist, self.dice, size=hits):
+            damage.append(max(int(roll) - effective_armor, 0))
             defender.current_health -= damage[-1]
             if defender.current_health <= 0:
                 defender.status = 'dead'
                 defender.current_health = 0
                 defender.coords = (-1, -1)
-                print(f'Killed {defender.name}')
-                return f'killed {defender.name}'
-        s = f'Did {"/".join(map(str, damage))} to {defender.name}'
-        print(s)
-        return s
+                return lch.DamageEvent(defender.name, tuple(damage), True)
+        return lch.DamageEvent(defender.name, tuple(damage), False)
 
     def shoot_action(self, action):
         attacker = action.model
@@ -137,20 +166,19 @@ class Game(object):
         shot_dist = self.bf.distance(start, end)
         penalty = attacker.rw.penalty(action.move_dist, action.shot_dist)
         if penalty is None:
-            return "Can\'t move and shoot a heavy weapon"
-        print(f'Penalty: {penalty}')
+            event = lch.ShootEvent(attacker.name, defender.name, attacker.rs, attacker.rc,
+                    None, (), 0, 0, None)
+            self.sink.emit(event)
+            return event
         attacks = attacker.rw.attacks
-        hit_rolls = norm.rvs(loc=attacker.rs, scale=attacker.rc, size=attacks)
+        hit_rolls = self.dice.normal(attacker.rs, attacker.rc, attacks)
         target_num = defender.dodge + sum(penalty)*attacker.rc
-        hits = sum(hit_rolls > target_num)
-        hit_rolls = [f'{x:.1f}' for x in hit_rolls]
-        s = f'Attack skill {attacker.rs}/{attacker.rc}, rolls {hit_rolls}, target {target_num:.1f}. '
-        if hits == 0:
-            print(s + f"No hits")
-            return s + f"No hits"
-        s += f"{hits} hits, " + self.do_damage(defender, attacker.rw, hits, shot_dist)
-        print(s)
-        return s
+        hits = int((hit_rolls > target_num).sum())
+        damage = None if hits == 0 else self.do_damage(defender, attacker.rw, hits, shot_dist)
+        event = lch.ShootEvent(attacker.name, defender.name, attacker.rs, attacker.rc,
+                penalty, hit_rolls, target_num, hits, damage)
+        self.sink.emit(event)
+        return event
 
     def melee_action(self, action):
         attacker = action.model
@@ -158,15 +186,14 @@ class Game(object):
         charged = isinstance(action, lch.MoveAction)
         bonus = attacker.mc * (action.move_dist > 0)
         attacks = attacker.mw.attacks
-        attack_roll = norm.rvs(loc=attacker.ms, scale=attacker.mc, size=attacks) + bonus
-        defense_roll = norm.rvs(loc=defender.ms, scale=defender.mc, size=attacks)
-        hits = sum(attack_roll > defense_roll)
-        attack_roll = [f'{x:.1f}' for x in attack_roll]
-        defense_roll = [f'{x:.1f}' for x in defense_roll]
-        s = f'Skill {attacker.ms}/{attacker.mc} vs {defender.ms}/{defender.mc}, rolls {attack_roll}/{defense_roll} '
-        if hits == 0:
-            return s + f'no hits'
-        return s + f"{hits} hits, " + self.do_damage(defender, attacker.mw, hits)
+        attack_roll = self.dice.normal(attacker.ms, attacker.mc, attacks) + bonus
+        defense_roll = self.dice.normal(defender.ms, defender.mc, attacks)
+        hits = int((attack_roll > defense_roll).sum())
+        damage = None if hits == 0 else self.do_damage(defender, attacker.mw, hits)
+        event = lch.MeleeEvent(attacker.name, defender.name, attacker.ms, attacker.mc,
+                defender.ms, defender.mc, attack_roll, defense_roll, hits, damage)
+        self.sink.emit(event)
+        return event
 
     def do_team_action(self, team_i):
         """
@@ -178,9 +205,17 @@ class Game(object):
         if len(actions) == 0:
             return None
         action = self.teams[team_i].AI.select_action(actions)
+        self.apply_action(team_i, action)
+        return action
+
+    def apply_action(self, team_i, action):
+        """
+        Carry out an action that team_i selected, and let the other team know
+        """
         self.engage_action(action)
         action.model.status = 'activated'
-        return action
+        if (enemy_ai := self.teams[team_i^1].AI) is not None:
+            enemy_ai.take_enemy_action(action)
 
     def turn(self, turn_i):
         other_team_action = 1 # start nonzero
@@ -193,16 +228,17 @@ class Game(object):
                     turn_finished = True
                     break
                 other_team_action = this_team_action
-
-                # save current state
-                for model in self.teams[t].models:
-                    self.add_to_replay(turn_i, step, model.get_snapshot())
-                for model in self.teams[t^1].models:
-                    self.add_to_replay(turn_i, step, model.get_snapshot())
+                self.record_step(turn_i, step, t)
             step += 1
 
         return
 
+    def record_step(self, turn_i, step, team_i):
+        """
+        Save the current state after team_i acted
+        """
+        self.replay.record(turn_i, step, self.clone())
+
     def game_loop(self):
         for i in range(1, self.max_turns+1):
             self.start_of_turn(i)
@@ -210,6 +246,20 @@ class Game(object):
             self.end_of_turn(i)
             if self.determine_victory(i):
                 break
+        self.save_replay()
+        return self.result()
+
+    def save_replay(self):
+        """
+        Hand the replay to the store, if we have one
+        """
+        if self.store:
+            self.store.add(self)
+
+    def result(self):
+        """
+        :returns: (winning AI hash, losing AI hash)
+        """
         w = int(self.teams[0].strength() < self.teams[1].strength())
         return self.teams[w].AI.hash, self.teams[w^1].AI.hash
 
@@ -0,0 +1,356 @@
+import lch
+import typing as ty
+import queue
+import multiprocessing as mp
+from multiprocessing import resource_tracker
+import numpy as np
+from functools import lru_cache
+
+__all__ = 'GameJob run_job WorkerPool'.split()
+
+class GameJob(ty.NamedTuple):
+    """
+    Everything needed to set up a game, small enough to send to another process
+    cheaply. The battlefield is described by its seed rather than sent whole
+    """
+    map_seed: np.random.SeedSequence
+    size: tuple
+    teams: tuple
+    ais: tuple
+    game_seed: np.random.SeedSequence
+    store: bool = False
+    metrics: bool = False
+
+@lru_cache(maxsize=32)
+def load_battlefield(entropy, spawn_key, size):
+    """
+    A Forest battlefield, built once per process and reused by every job on it
+    """
+    seed = np.random.SeedSequence(entropy, spawn_key=spawn_key)
+    return lch.Battlefield(*size, lch.Forest(*size, rng=seed))
+
+# AIs this process has been sent, as encoded tuples, and the decoded ones
+ai_tuples = {}
+ai_cache = {}
+# WeightArenas this process is attached to by name, and which one each AI came from
+arenas = {}
+arena_of = {}
+
+def register_ais(tuples):
+    """
+    Make AIs known to this process without going through the db
+    :param tuples: iterable of tuples, from AI.encode
+    """
+    for args in tuples:
+        ai_tuples[args[0]] = args
+
+def forget_ais(hashes):
+    """
+    Drop AIs that won't be playing any more
+    :param hashes: iterable of AI hashes
+    """
+    for h in hashes:
+        ai_tuples.pop(h, None)
+        ai_cache.pop(h, None)
+        arena_of.pop(h, None)
+    release_arenas()
+
+def release_arenas():
+    """
+    Detach from arenas none of whose AIs are in use any more
+    """
+    in_use = set(arena_of.values())
+    for name in [n for n in arenas if n not in in_use]:
+        try:
+            arenas[name].close()
+            del arenas[name]
+        except BufferError:
+            # something still has hold of one of its AIs, try again next time
+            pass
+
+def attach_weights(handle):
+    """
+    Load AIs from a WeightArena another process made. Their arrays are views
+    into shared memory, so this costs next to nothing however many processes
+    do it
+    :param handle: from WeightArena.handle
+    """
+    try:
+        arena = lch.WeightArena.attach(handle)
+    except FileNotFoundError:
+        # already gone, so its AIs were forgotten or shared again before this
+        # process got to them
+        return
+    arenas[arena.name] = arena
+    for h in arena.layout:
+        ai_cache[h] = arena.load(h)
+        arena_of[h] = arena.name
+    # AIs that were in an older arena come from this one now
+    release_arenas()
+
+def load_ai(_hash):
+    """
+    An AI decoded once per process, from what register_ais was given or else
+    from the db. Games get forks of it
+    """
+    if (ret := ai_cache.get(_hash)) is None:
+        if (args := ai_tuples.get(_hash)) is not None:
+            ret = getattr(lch, args[2]).from_tuple(args)
+        else:
+            ret = lch.AI.from_hash(_hash)
+        ai_cache[_hash] = ret
+    return ret
+
+def run_job(job):
+    """
+    Play the game a job describes. Meant to be run in a worker process
+    :param job: GameJob
+    :returns: ((winning AI hash, losing AI hash), encoded replay or None,
+        Metrics snapshot of the job or None)
+    """
+    if job.metrics:
+        lch.Metrics.enable()
+        before = lch.Metrics.snapshot()
+    bf = load_battlefield(job.map_seed.entropy, job.map_seed.spawn_key, tuple(job.size))
+    ais = [None if h is None else load_ai(h) for h in job.ais]
+    game = lch.Game(job.teams, ais, bf, seed=job.game_seed, sink=lch.NullSink())
+    result = game.game_loop()
+    replay = lch.ReplayStore.encode(game) if job.store else None
+    metrics = lch.Metrics.diff(lch.Metrics.snapshot(), before) if job.metrics else None
+    return result, replay, metrics
+
+def worker_main(worker_i, control, jobs, results, slot):
+    """
+    The loop each WorkerPool process runs. Updates to the known AIs arrive on
+    control, each tagged with a version, and a job is only started once every
+    update it was submitted after has been applied. The job being played goes
+    in slot, where the pool can see it even if this process dies before
+    anything it put on results gets through
+    """
+    version = 0
+    while (item := jobs.get()) is not None:
+        batch_i, job_i, job_version, job = item
+        while version < job_version:
+            version, kind, payload = control.get()
+            if kind == 'register':
+                register_ais(payload)
+            elif kind == 'share':
+                attach_weights(payload)
+            elif kind == 'sync':
+                register_ais(payload[0])
+                for handle in payload[1]:
+                    attach_weights(handle)
+            else:
+                forget_ais(payload)
+        with slot.get_lock():
+            slot[0], slot[1] = batch_i, job_i
+        try:
+            results.put(('done', worker_i, batch_i, job_i, run_job(job)))
+        except Exception as e:
+            results.put(('error', worker_i, batch_i, job_i, repr(e)))
+
+class WorkerPool(object):
+    """
+    Processes that live as long as the pool does, so they keep their decoded
+    AIs and battlefields (with their pathing caches) from one batch of jobs to
+    the next. New AIs are sent to every worker once with register rather than
+    with each job. A worker that dies is replaced, and whatever job it was in
+    the middle of goes back in the queue
+    """
+    def __init__(self, workers):
+        """
+        :param workers: int, how many processes
+        """
+        self.ctx = mp.get_context()
+        # forked workers would otherwise each start their own tracker when
+        # they attach to a WeightArena, and unlink it when they exit
+        resource_tracker.ensure_running()
+        self.jobs = self.ctx.Queue()
+        self.results = self.ctx.Queue()
+        self.version = 0
+        self.known = {} # hash: encoded tuple, for bringing new workers up to date
+        self.arenas = {} # name: WeightArena, for AIs sent with share
+        self.arena_of = {} # hash: name of the newest arena it's in
+        self.batch_i = 0
+        self.batches = {} # batch index: list of jobs, for batches still going
+        self.done = {} # batch index: list of (kind, job index, result) not yet collected
+        self.controls = [None]*workers
+        self.procs = [None]*workers
+        # (batch index, job index) each worker last started, -1s before any
+        self.slots = [None]*workers
+        for i in range(workers):
+            self.start_worker(i)
+
+    def start_worker(self, i):
+        control = self.ctx.Queue()
+        # a new worker only needs the current set of AIs, not the history
+        control.put((self.version, 'sync', (list(self.known.values()),
+            [arena.handle for arena in self.arenas.values()])))
+        # a new slot each time, so nothing a dead worker did can land in it
+        slot = self.ctx.Array('q', [-1, -1])
+        proc = self.ctx.Process(target=worker_main, args=(i, control, self.jobs, self.results,
+                slot), daemon=True)
+        proc.start()
+        self.controls[i], self.procs[i], self.slots[i] = control, proc, slot
+
+    def send(self, kind, payload):
+        self.version += 1
+        for control in self.controls:
+            control.put((self.version, kind, payload))
+
+    def register(self, tuples):
+        """
+        Tell every worker about some AIs
+        :param tuples: list of tuples, from AI.encode
+        """
+        tuples = list(tuples)
+        self.known.update((args[0], args) for args in tuples)
+        self.send('register', tuples)
+
+    def share(self, ais):
+        """
+        Tell every worker about some AIs by putting their weights in shared
+        memory, which the workers all use rather than each having a copy
+        :param ais: list of AIs
+        """
+        arena = lch.WeightArena.create(ais)
+        self.arenas[arena.name] = arena
+        self.arena_of.update((h, arena.name) for h in arena.layout)
+        self.send('share', arena.handle)
+        self.release_arenas()
+
+    def release_arenas(self):
+        """
+        Free arenas whose AIs have all been forgotten or shared again since.
+        Workers keep their mappings, only the name goes away, and one that
+        never got as far as attaching to an arena doesn't need it
+        """
+        in_use = set(self.arena_of.values())
+        for name in [n for n in self.arenas if n not in in_use]:
+            self.arenas.pop(name).close()
+
+    def forget(self, hashes):
+        """
+        Tell every worker some AIs are done with. Shared memory is freed once
+        all the AIs in it are forgotten
+        :param hashes: list of AI hashes
+        """
+        hashes = list(hashes)
+        for h in hashes:
+            self.known.pop(h, None)
+            self.arena_of.pop(h, None)
+        self.send('forget', hashes)
+        self.release_arenas()
+
+    def submit(self, jobs):
+        """
+        Queue up some jobs without waiting for them. Batches run in the order
+        they were submitted, so a later one can fill in the gaps as an earlier
+        one finishes
+        :param jobs: list of GameJobs
+        :returns: int, the batch index, for as_completed and cancel
+        """
+        self.batch_i += 1
+        batch_i, jobs = self.batch_i, list(jobs)
+        self.batches[batch_i] = jobs
+        self.done[batch_i] = []
+        for job_i, job in enumerate(jobs):
+            self.jobs.put((batch_i, job_i, self.version, job))
+        return batch_i
+
+    def poll(self, timeout=1):
+        """
+        Wait for a message from the workers and sort it into its batch
+        """
+        self.check_workers()
+        try:
+            kind, worker_i, batch_i, job_i, ret = self.results.get(timeout=timeout)
+        except queue.Empty:
+            return
+        # results of cancelled batches are dropped
+        if batch_i in self.done:
+            self.done[batch_i].append((kind, job_i, ret))
+
+    def as_completed(self, batch_i):
+        """
+        :param batch_i: int, from submit
+        :yields: (index into the batch's jobs, what run_job returned), as each job finishes
+        """
+        jobs = self.batches[batch_i]
+        remaining = set(range(len(jobs)))
+        while remaining:
+            if not self.done[batch_i]:
+                self.poll()
+            while self.done[batch_i]:
+                kind, job_i, ret = self.done[batch_i].pop(0)
+                if job_i not in remaining:
+                    # run again after its worker died
+                    continue
+                if kind == 'error':
+                    raise RuntimeError(f'Job {jobs[job_i]} failed: {ret}')
+                remaining.remove(job_i)
+                yield job_i, ret
+        del self.batches[batch_i]
+        del self.done[batch_i]
+
+    def cancel(self, batch_i):
+        """
+        Forget about a batch. Jobs of it that no worker has picked up yet are
+        taken out of the queue, anything already running is left to finish
+        and its result dropped. Does nothing if the batch is already done
+        """
+        if self.batches.pop(batch_i, None) is None:
+            return
+        del self.done[batch_i]
+        keep = []
+        try:
+            while True:
+                item = self.jobs.get_nowait()
+                if item[0] in self.batches:
+                    keep.append(item)
+        except queue.Empty:
+            pass
+        for item in keep:
+            self.jobs.put(item)
+
+    def imap_unordered(self, jobs):
+        """
+        Run some jobs
+        :param jobs: list of GameJobs
+        :yields: (index into jobs, what run_job returned), as each job finishes
+        """
+        batch_i = self.submit(jobs)
+        try:
+            yield from self.as_completed(batch_i)
+        finally:
+            # don't leave our jobs for the next batch
+            self.cancel(batch_i)
+
+    def check_workers(self):
+        """
+        Replace dead workers and requeue the last job each one started. That
+        job may have finished after all, its result still on the way, but
+        as_completed only counts a job once
+        """
+        for i, proc in enumerate(self.procs):
+            if proc.is_alive():
+                continue
+            with self.slots[i].get_lock():
+                batch_i, job_i = self.slots[i]
+            self.start_worker(i)
+            if batch_i in self.batches:
+                self.jobs.put((batch_i, job_i, self.version, self.batches[batch_i][job_i]))
+
+    def close(self):
+        """
+        Stop the workers
+        """
+        for _ in self.procs:
+            self.jobs.put(None)
+        for proc in self.procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        for arena in self.arenas.values():
+            arena.close()
+        self.arenas.clear()
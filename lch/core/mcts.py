@@ -0,0 +1,331 @@
+import lch
+import os
+import time
+import numpy as np
+from math import log, sqrt
+from concurrent.futures import ProcessPoolExecutor
+from .ai import AI
+
+__all__ = 'MCTS'.split()
+
+def signature(action):
+    """
+    Identifies an action independently of the Action object, so trees survive
+    the actions being regenerated and can be merged between processes
+    """
+    if action is None:
+        return None
+    return (action.__class__.__name__, action.model.game_hash, action.move_dest,
+            action.target and action.target.game_hash)
+
+class Node(object):
+    """
+    One decision in the search tree. Open-loop, so a node stands for a sequence
+    of actions rather than a specific state, which is what lets us keep using
+    it after the dice have had their say
+    """
+    __slots__ = ('to_move', 'children', 'visits', 'value')
+
+    def __init__(self, to_move):
+        """
+        :param to_move: 0 or 1, the team deciding at this node
+        """
+        self.to_move = to_move
+        self.children = {}
+        self.visits = 0
+        self.value = 0.
+
+    def child(self, sig, to_move):
+        if (c := self.children.get(sig)) is None:
+            c = self.children[sig] = Node(to_move)
+        return c
+
+class MCTS(AI):
+    """
+    Monte Carlo tree search. Candidate actions come from Team.generate_actions,
+    and playouts use a cheap default policy: a random ready model does a random
+    one of its actions. Needs to know which game it's playing, which Game sets up
+    """
+    game = None
+
+    @classmethod
+    def base_fields(cls):
+        return 'iterations time_budget exploration rollout_depth workers'.split()
+
+    @classmethod
+    def from_scratch(cls, rng=None, iterations=100, time_budget=0, exploration=1.4,
+            rollout_depth=8, workers=1):
+        """
+        :param rng: a np.random.Generator or seed, see lch.get_rng
+        :param iterations: int, playouts per decision
+        :param time_budget: float, seconds per decision. If nonzero this is used
+            instead of iterations
+        :param exploration: float, the UCT exploration constant, default 1.4
+        :param rollout_depth: int, how many actions a playout goes past the tree
+        :param workers: int, how many processes to run playouts in, default 1.
+            Only worth it with cores to spare and a budget big enough that
+            each decision's search takes much longer than sending the state
+            to the workers and having each of them work out the actions
+            again, hundreds of iterations rather than tens. It also gives up
+            most of the tree kept from one decision to the next, see
+            parallel_search. Capped at the CPUs this process can use
+        """
+        return cls(rng=rng, iterations=iterations, time_budget=time_budget,
+                exploration=exploration, rollout_depth=rollout_depth, workers=workers)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.root = None
+        self.pool = None
+        self.pool_game = None
+
+    def fork(self, rng=None):
+        # a fork plays a different game, so it gets its own tree and workers
+        ret = super().fork(rng)
+        ret.root = None
+        ret.pool = None
+        ret.pool_game = None
+        return ret
+
+    def __getstate__(self):
+        # the tree and the pool stay in this process
+        state = self.__dict__.copy()
+        state['root'] = None
+        state['pool'] = None
+        state['pool_game'] = None
+        return state
+
+    def __del__(self):
+        if getattr(self, 'pool', None) is not None:
+            self.pool.shutdown(wait=False)
+
+    def mutate_batch(self, *args, **kwargs):
+        raise NotImplementedError('Nothing to learn here')
+
+    def select_action(self, actions):
+        if len(actions) == 0:
+            return lch.NoAction()
+        team_i = self.game.teams.index(actions[0].model.team)
+        # pick up where the last search left off, if we got here the way it expected
+        root = self.root
+        while root is not None and root.to_move != team_i:
+            root = root.children.get(None)
+        if root is None:
+            root = Node(team_i)
+
+        if self.n_workers() > 1:
+            self.parallel_search(root, team_i, actions)
+        else:
+            self.search(root, team_i, actions, self.budget(), self.rng)
+
+        sigs = list(map(signature, actions))
+        visits = [root.children[s].visits if s in root.children else -1 for s in sigs]
+        best = actions[int(np.argmax(visits))]
+        self.root = root.children.get(signature(best))
+        return best
+
+    def take_enemy_action(self, action):
+        if self.root is not None:
+            self.root = self.root.children.get(signature(action))
+
+    def n_workers(self):
+        """
+        :returns: int, how many processes to search in, workers but no more
+            than there are CPUs to run them on
+        """
+        if hasattr(os, 'sched_getaffinity'):
+            cpus = len(os.sched_getaffinity(0))
+        else:
+            cpus = os.cpu_count() or 1
+        return max(1, min(int(self.workers), cpus))
+
+    def budget(self, fraction=1):
+        """
+        :returns: (max iterations, deadline)
+        """
+        if float(self.time_budget) > 0:
+            return None, time.perf_counter() + float(self.time_budget)
+        return int(np.ceil(int(self.iterations)*fraction)), None
+
+    def search(self, root, team_i, actions, budget, rng):
+        """
+        Grow the tree. The game is left the way it was found
+        :param root: Node for the current decision
+        :param team_i: 0 or 1, who's deciding
+        :param actions: the candidate actions for the current state
+        :param budget: (max iterations, deadline) tuple, one of which is None
+        :param rng: a np.random.Generator for the playouts
+        :returns: None
+        """
+        game = self.game
+        state = game.clone()
+        sink, dice = game.sink, game.dice
+        game.sink, game.dice = lch.NullSink(), lch.Dice(rng)
+        iterations, deadline = budget
+        try:
+            i = 0
+            while (i < iterations) if deadline is None else (time.perf_counter() < deadline):
+                self.iterate(root, team_i, actions, game.turn_i, rng)
+                game.restore(state)
+                i += 1
+        finally:
+            game.sink, game.dice = sink, dice
+
+    def iterate(self, root, team_i, actions, turn_i, rng):
+        """
+        One selection-expansion-playout-backup pass
+        """
+        game = self.game
+        node, to_move, path = root, team_i, [root]
+        expanded = False
+        while not expanded and not self.game_over(turn_i):
+            if node is not root:
+                if not game.teams[to_move].remaining_actions():
+                    to_move, turn_i = self.pass_turn(to_move, turn_i)
+                    node = node.child(None, to_move)
+                    path.append(node)
+                    continue
+                actions = game.teams[to_move].generate_actions(game.teams[to_move^1], game.bf)
+                if not actions:
+                    # nobody left can do anything, which the game treats as passing
+                    for m in game.teams[to_move]:
+                        if m.status == 'ready':
+                            m.status = 'activated'
+                    to_move, turn_i = self.pass_turn(to_move, turn_i)
+                    node = node.child(None, to_move)
+                    path.append(node)
+                    continue
+            by_sig = {signature(a): a for a in actions}
+            untried = [s for s in by_sig if s not in node.children]
+            if untried:
+                sig = untried[rng.integers(len(untried))]
+                expanded = True
+            else:
+                sig = self.uct(node, by_sig, to_move == team_i)
+            game.engage_action(by_sig[sig])
+            to_move, turn_i = self.next_to_move(to_move, turn_i)
+            node = node.child(sig, to_move)
+            path.append(node)
+        value = self.playout(team_i, to_move, turn_i, rng)
+        for n in path:
+            n.visits += 1
+            n.value += value
+
+    def uct(self, node, by_sig, ours):
+        """
+        Upper confidence bound among the children that are possible right now.
+        Values are stored from the searching team's point of view, so the other
+        team minimizes them
+        :param ours: bool, is the searching team the one deciding
+        """
+        sign = 1 if ours else -1
+        log_n = log(max(node.visits, 1))
+        c = float(self.exploration)
+        best, best_score = None, -np.inf
+        for sig in by_sig:
+            child = node.children[sig]
+            score = sign*child.value/child.visits + c*sqrt(log_n/child.visits)
+            if score > best_score:
+                best, best_score = sig, score
+        return best
+
+    def next_to_move(self, to_move, turn_i):
+        """
+        After to_move does something, who's next? Mirrors Game.turn
+        """
+        game = self.game
+        if game.teams[to_move^1].remaining_actions():
+            return to_move^1, turn_i
+        return self.pass_turn(to_move^1, turn_i)
+
+    def pass_turn(self, to_move, turn_i):
+        """
+        to_move has nothing left to do
+        """
+        game = self.game
+        if game.teams[to_move^1].remaining_actions():
+            return to_move^1, turn_i
+        # nobody can do anything, next turn
+        for team in game.teams:
+            team.ready_up()
+        return 0, turn_i + 1
+
+    def game_over(self, turn_i):
+        return (turn_i > self.game.max_turns or self.game.teams[0].is_dead() or
+                self.game.teams[1].is_dead())
+
+    def playout(self, team_i, to_move, turn_i, rng):
+        """
+        Play on with the default policy, then score the result
+        :returns: float in [-1, 1], good for team_i is positive
+        """
+        game = self.game
+        for _ in range(int(self.rollout_depth)):
+            if self.game_over(turn_i):
+                break
+            team, enemies = game.teams[to_move], game.teams[to_move^1]
+            ready = [m for m in team if m.status == 'ready']
+            model = ready[rng.integers(len(ready))]
+            actions = model.generate_actions(team.coordinates(exclude=model), enemies, game.bf)
+            if actions:
+                game.engage_action(actions[rng.integers(len(actions))])
+            else:
+                model.status = 'activated'
+            to_move, turn_i = self.next_to_move(to_move, turn_i)
+        if game.teams[team_i^1].is_dead():
+            return 1.
+        if game.teams[team_i].is_dead():
+            return -1.
+        ours, theirs = game.teams[team_i].strength(), game.teams[team_i^1].strength()
+        return (ours - theirs)/max(ours + theirs, 1)
+
+    def parallel_search(self, root, team_i, actions):
+        """
+        Root parallelization: this process searches its share from the tree
+        it kept from the last decision, while each of the other workers grows
+        a new tree from a copy of the game, and the statistics of the first
+        decision of theirs are merged into ours. The workers get the game
+        once, when they start, and after that only the state to search from
+        """
+        n = self.n_workers()
+        if self.pool is None or self.pool_game is not self.game:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False)
+            self.pool = ProcessPoolExecutor(max_workers=n-1,
+                    initializer=init_search_worker, initargs=(self.game,))
+            self.pool_game = self.game
+        seeds = self.rng.integers(2**63, size=n-1)
+        budget = self.budget(1/n)
+        state = self.game.clone()
+        futures = [self.pool.submit(search_worker, state, self.game.turn_i, team_i, budget, seed)
+                for seed in seeds]
+        self.search(root, team_i, actions, budget, self.rng)
+        for f in futures:
+            for sig, (to_move, visits, value) in f.result().items():
+                child = root.child(sig, to_move)
+                child.visits += visits
+                child.value += value
+                root.visits += visits
+                root.value += value
+
+# the game in an MCTS worker process, see init_search_worker
+worker_game = None
+
+def init_search_worker(game):
+    global worker_game
+    worker_game = game
+
+def search_worker(state, turn_i, team_i, budget, seed):
+    """
+    Runs in a worker process for MCTS.parallel_search
+    :param state: GameState to search from
+    :returns: dict of {signature: (to_move, visits, value)} for the root's children
+    """
+    game = worker_game
+    game.restore(state)
+    game.turn_i = turn_i
+    ai = game.teams[team_i].AI
+    actions = game.teams[team_i].generate_actions(game.teams[team_i^1], game.bf)
+    root = Node(team_i)
+    ai.search(root, team_i, actions, budget, lch.get_rng(seed))
+    return {sig: (c.to_move, c.visits, c.value) for sig, c in root.children.items()}
@@ -0,0 +1,138 @@
+import lch
+import functools
+import threading
+import time
+
+__all__ = 'Metrics'.split()
+
+class Metrics(object):
+    """
+    Call counts and time spent in the hot parts of the engine. Nothing is
+    measured until enable is called, which swaps timing wrappers in for the
+    methods in hot_methods; disable puts the originals back, so switched off
+    this costs nothing at all. Everything is per process, so workers send
+    their numbers back with their results (see run_job) to be added up.
+
+    Phases nest, a game's time includes its decisions' for instance, so each
+    metric has both its total time and its self time, which leaves out the
+    time spent in other measured phases inside it. Self times add up to no
+    more than the time measured
+    """
+    # metric: [(class name, method name)]
+    hot_methods = {
+            'games': [('Game', 'game_loop')],
+            'decisions': [('Game', 'apply_action')],
+            'actions': [('Team', 'generate_actions')],
+            'astar': [('Battlefield', 'astar_path')],
+            'los': [('Battlefield', 'los_range')],
+            'reachable': [('Battlefield', 'reachable')],
+            'features': [('AI', 'normalize_input')],
+            'inference': [('AI', 'process_batch'), ('DenseMultilayer', 'process_batch'),
+                ('QuantizedDenseMultilayer', 'process_batch')],
+            'combat': [('Game', 'shoot_action'), ('Game', 'melee_action')],
+            'replay': [('ReplayRecorder', 'record'), ('ReplayStore', 'write_batch')],
+            }
+    stats = {} # metric: [calls, total seconds, self seconds]
+    originals = {} # (class, method name): the unwrapped function
+    # per thread, [stats, seconds spent in nested phases] of each phase the
+    # thread is in, innermost last
+    local = threading.local()
+
+    @classmethod
+    def enabled(cls):
+        return len(cls.originals) > 0
+
+    @classmethod
+    def enable(cls):
+        """
+        Start measuring. Does nothing if already measuring
+        """
+        if cls.enabled():
+            return
+        for name, methods in cls.hot_methods.items():
+            cls.stats.setdefault(name, [0, 0., 0.])
+            for class_name, method in methods:
+                owner = getattr(lch, class_name)
+                f = owner.__dict__[method]
+                cls.originals[(owner, method)] = f
+                setattr(owner, method, cls.timed(cls.stats[name], f))
+
+    @classmethod
+    def disable(cls):
+        """
+        Stop measuring, the numbers so far are kept
+        """
+        for (owner, method), f in cls.originals.items():
+            setattr(owner, method, f)
+        cls.originals.clear()
+
+    @classmethod
+    def timed(cls, stats, f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if (stack := getattr(cls.local, 'stack', None)) is None:
+                stack = cls.local.stack = []
+            # a phase called from inside itself only counts once in its total
+            outermost = all(s is not stats for s, _ in stack)
+            stack.append([stats, 0.])
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = stack.pop()[1]
+                if stack:
+                    stack[-1][1] += elapsed
+                stats[0] += 1
+                if outermost:
+                    stats[1] += elapsed
+                stats[2] += elapsed - nested
+        return wrapper
+
+    @classmethod
+    def reset(cls):
+        for v in cls.stats.values():
+            v[0], v[1], v[2] = 0, 0., 0.
+
+    @classmethod
+    def snapshot(cls):
+        """
+        :returns: dict of {metric: (calls, total seconds, self seconds)}
+        """
+        return {k: tuple(v) for k, v in cls.stats.items()}
+
+    @staticmethod
+    def diff(after, before):
+        """
+        What happened between two snapshots
+        """
+        return {k: tuple(a - b for a, b in zip(v, before.get(k, (0, 0., 0.))))
+                for k, v in after.items()}
+
+    @staticmethod
+    def merge(*snapshots):
+        """
+        Add up snapshots, from different processes say
+        """
+        ret = {}
+        for snap in snapshots:
+            for k, v in snap.items():
+                ret[k] = tuple(a + b for a, b in zip(ret.get(k, (0, 0., 0.)), v))
+        return ret
+
+    @staticmethod
+    def report(snapshot, wall_time):
+        """
+        :param snapshot: dict, from snapshot or merge
+        :param wall_time: float, seconds the snapshot covers
+        :returns: str, human readable summary
+        """
+        games = snapshot.get('games', (0,))[0]
+        decisions = snapshot.get('decisions', (0,))[0]
+        lines = [f'{games/wall_time:.2f} games/s, {decisions/wall_time:.1f} actions/s '
+                 f'over {wall_time:.1f} s',
+                 f'  {"":<10} {"calls":>9} {"total s":>9} {"self s":>9} {"us/call":>9}']
+        for k, (c, t, own) in snapshot.items():
+            if c:
+                lines.append(f'  {k:<10} {c:>9} {t:>9.2f} {own:>9.2f} {1e6*t/c:>9.1f}')
+        return '\n'.join(lines)
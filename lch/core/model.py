@@ -59,6 +59,7 @@ class Model(object):
                 armor INTEGER);""")
         except Exception as e:
             pass
+        lch.forget_columns('model')
 
     @property
     def skills(self):
@@ -73,7 +74,7 @@ class Model(object):
 
     @classmethod
     def from_hash(cls, _hash):
-        args = lch.load_from_cache('model', _hash)
+        args = lch.catalog.get('model', _hash)
         return cls.from_tuple(args)
 
     @classmethod
@@ -110,6 +111,8 @@ class Model(object):
 
         actions = []
         action_kwargs = self.evaluate_coords(None, enemies, bf, occupied)
+        # dead models are off the board
+        enemies = [e for e in enemies if e.status != 'dead']
         # first, are we in combat already?
         if self.coords in enemy_adjacent:
             for enemy in enemies:
@@ -0,0 +1,150 @@
+import lch
+import datetime
+
+__all__ = 'RatingStore'.split()
+
+class RatingStore(object):
+    """
+    Elo ratings for AIs, kept in the rating table of the cache so they last
+    from one run to the next. Ratings move a little after every game rather
+    than being worked out again from scratch, so an AI that's been around for
+    a while doesn't need to replay anything to be compared with a new one.
+    AIs still in the ai table are active, pruning deactivates them
+    """
+    initial = 1500.
+    scale = 400.
+
+    def __init__(self, conn=None, k=32.):
+        """
+        :param conn: sqlite connection, default lch.get_db()
+        :param k: float, the most a rating moves in one game, default 32
+        """
+        self.conn = conn or lch.get_db()
+        self.k = k
+        self.create_table(self.conn)
+        self.ratings = {}
+        self.games = {}
+        self.wins = {}
+        self.active = {}
+        for _hash, rating, games, wins, active in self.conn.execute(
+                'SELECT hash, rating, games, wins, active FROM rating;'):
+            self.ratings[_hash] = rating
+            self.games[_hash] = games
+            self.wins[_hash] = wins
+            self.active[_hash] = bool(active)
+
+    @staticmethod
+    def create_table(conn):
+        conn.execute('CREATE TABLE IF NOT EXISTS rating ( '
+            'hash TEXT PRIMARY KEY NOT NULL, '
+            'rating REAL, '
+            'games INTEGER, '
+            'wins INTEGER, '
+            'active INTEGER, '
+            'updated TEXT );')
+        conn.commit()
+        lch.forget_columns('rating')
+
+    def get(self, _hash):
+        """
+        :returns: float, the rating, or the initial rating for AIs never seen
+        """
+        return self.ratings.get(_hash, self.initial)
+
+    def expected(self, a, b):
+        """
+        :returns: float, the chance a beats b according to the ratings
+        """
+        return 1/(1 + 10**((self.get(b) - self.get(a))/self.scale))
+
+    def add(self, _hash):
+        if _hash not in self.ratings:
+            self.ratings[_hash] = self.initial
+            self.games[_hash] = 0
+            self.wins[_hash] = 0
+        self.active[_hash] = True
+
+    def enter(self, hashes):
+        """
+        Start tracking some AIs, before they've played anything
+        :param hashes: iterable of AI hashes
+        """
+        hashes = list(hashes)
+        for h in hashes:
+            self.add(h)
+        self.save(hashes)
+
+    def record(self, results):
+        """
+        Update ratings from some game results, in the order given, and save
+        the AIs involved in one transaction
+        :param results: iterable of (winning AI hash, losing AI hash)
+        :returns: None
+        """
+        touched = set()
+        for w, l in results:
+            self.add(w)
+            self.add(l)
+            delta = self.k*(1 - self.expected(w, l))
+            self.ratings[w] += delta
+            self.ratings[l] -= delta
+            self.games[w] += 1
+            self.games[l] += 1
+            self.wins[w] += 1
+            touched.update((w, l))
+        self.save(touched)
+
+    def save(self, hashes):
+        now = datetime.datetime.now().isoformat(sep=' ')
+        self.conn.executemany('INSERT OR REPLACE INTO rating VALUES (?,?,?,?,?,?);',
+                [(h, self.ratings[h], self.games[h], self.wins[h], int(self.active[h]), now)
+                    for h in hashes])
+        self.conn.commit()
+
+    def ranking(self, active_only=True):
+        """
+        :param active_only: bool, leave out pruned AIs, default True
+        :returns: list of AI hashes, highest rated first
+        """
+        return sorted((h for h in self.ratings if self.active[h] or not active_only),
+                key=self.ratings.get, reverse=True)
+
+    def hall_of_fame(self, n):
+        """
+        :returns: list of the hashes of the n highest rated active AIs
+        """
+        return self.ranking()[:n]
+
+    def sample(self, n, rng=None, pool_size=None, exclude=()):
+        """
+        Opponents from the hall of fame, without replacement
+        :param n: int, how many
+        :param rng: a np.random.Generator or seed, see lch.get_rng
+        :param pool_size: int, how big the hall of fame is, default everyone
+        :param exclude: AI hashes that can't be picked
+        :returns: list of up to n AI hashes
+        """
+        candidates = [h for h in self.hall_of_fame(pool_size) if h not in exclude]
+        if len(candidates) <= n:
+            return candidates
+        idx = lch.get_rng(rng).choice(len(candidates), size=n, replace=False)
+        return [candidates[i] for i in sorted(idx)]
+
+    def prune(self, keep, protect=(), among=None):
+        """
+        Deactivate every active AI that isn't in the top keep or protected
+        :param keep: int, the size of the hall of fame
+        :param protect: AI hashes that stay active regardless
+        :param among: AI hashes to rank and prune, default every active AI.
+            Pass the AIs a run made so it leaves other runs' alone
+        :returns: list of the hashes deactivated, for removing from the ai table
+        """
+        ranking = self.ranking()
+        if among is not None:
+            among = set(among)
+            ranking = [h for h in ranking if h in among]
+        ret = [h for h in ranking[keep:] if h not in protect]
+        for h in ret:
+            self.active[h] = False
+        self.save(ret)
+        return ret
@@ -0,0 +1,356 @@
+import lch
+import atexit
+import os
+import os.path as osp
+import queue
+import threading
+import sqlite3 as sql
+import numpy as np
+from .game import GameState
+
+__all__ = 'ReplayRecorder ReplayStore ReplayReader'.split()
+
+class ReplayRecorder(object):
+    """
+    Records how a game went as a typed array of rows. A row is only written
+    when a model's health, status or position has changed since the last step,
+    except every so often all models are written as a keyframe so nobody has to
+    go back to the start of the game to find out where everything is. Models are
+    identified by their index in Game.models, the hashes are kept once in
+    model_hashes
+    """
+    dtype = np.dtype([
+        ('turn', np.int16),
+        ('step', np.int16),
+        ('model', np.uint8),
+        ('keyframe', np.bool_),
+        ('health', np.int16),
+        ('status', np.int8),
+        ('x', np.int16),
+        ('y', np.int16),
+        ])
+
+    def __init__(self, models, keyframe_interval=32, capacity=256):
+        """
+        :param models: list of Models, in the order of Game.models
+        :param keyframe_interval: int, steps between keyframes, default 32
+        :param capacity: int, how many rows to allocate to start with
+        """
+        self.model_hashes = [m.game_hash for m in models]
+        self.keyframe_interval = keyframe_interval
+        self.buffer = np.empty(capacity, dtype=self.dtype)
+        self.n = 0
+        self.last = None
+        self.since_keyframe = 0
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def rows(self):
+        """
+        The recorded rows, a view into the buffer
+        """
+        return self.buffer[:self.n]
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
+
+    def record(self, turn_i, step, state):
+        """
+        Add a step to the replay
+        :param turn_i: int, the turn
+        :param step: int, the step within the turn
+        :param state: GameState, from Game.clone
+        :returns: None
+        """
+        keyframe = self.last is None or self.since_keyframe >= self.keyframe_interval
+        if keyframe:
+            changed = np.arange(len(state.health))
+            self.since_keyframe = 0
+        else:
+            changed = np.flatnonzero((state.health != self.last.health) |
+                    (state.status != self.last.status) |
+                    (state.coords != self.last.coords).any(axis=1))
+            self.since_keyframe += 1
+        self.last = state
+        if len(changed) == 0:
+            return
+        if self.n + len(changed) > len(self.buffer):
+            self.buffer = np.resize(self.buffer, 2*(self.n + len(changed)))
+        rows = self.buffer[self.n:self.n+len(changed)]
+        rows['turn'] = turn_i
+        rows['step'] = step
+        rows['model'] = changed
+        rows['keyframe'] = keyframe
+        rows['health'] = state.health[changed]
+        rows['status'] = state.status[changed]
+        rows['x'] = state.coords[changed, 0]
+        rows['y'] = state.coords[changed, 1]
+        self.n += len(changed)
+
+class ReplayStore(object):
+    """
+    One database for the replays of many games. Games are handed over with add
+    and written by a background thread, which batches whatever has queued up
+    into one transaction. Nothing is guaranteed to be on disk until flush or
+    close has returned
+    """
+    shared_store = None
+
+    def __init__(self, fn=None, batch_size=256, timeout=1.0):
+        """
+        :param fn: str, the database file. Default is games/replays.db next to
+            the data directory
+        :param batch_size: int, the most games per transaction, default 256
+        :param timeout: float, seconds the writer waits to fill a batch, default 1
+        """
+        if fn is None:
+            fn = osp.join(osp.dirname(lch.cache_dir), 'games', 'replays.db')
+            os.makedirs(osp.dirname(fn), exist_ok=True)
+        self.fn = fn
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def shared(cls):
+        """
+        The store that Game(store=True) uses, made the first time it's needed
+        and closed when the interpreter exits
+        """
+        if cls.shared_store is None:
+            cls.shared_store = cls()
+            atexit.register(cls.shared_store.close)
+        return cls.shared_store
+
+    @staticmethod
+    def create_tables(conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS games (
+            hash TEXT PRIMARY KEY NOT NULL,
+            battlefield TEXT,
+            team0 TEXT,
+            team1 TEXT,
+            ai0 TEXT,
+            ai1 TEXT,
+            models TEXT);""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS battlefield (
+            hash TEXT,
+            x INTEGER,
+            y INTEGER,
+            move REAL,
+            los REAL,
+            PRIMARY KEY (hash, x, y));""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS replay (
+            game TEXT,
+            turn INTEGER,
+            step INTEGER,
+            model INTEGER,
+            keyframe INTEGER,
+            current_health INTEGER,
+            status INTEGER,
+            x INTEGER,
+            y INTEGER);""")
+
+    @staticmethod
+    def encode(game):
+        """
+        Everything about a game that gets stored, as plain tuples. Can be done
+        in another process and the result handed to add_encoded
+        :param game: Game, presumably finished
+        :returns: (games row, list of battlefield rows, list of replay rows)
+        """
+        info = (game.hash, game.bf.hash,
+                game.teams[0].hash, game.teams[1].hash,
+                game.teams[0].AI and game.teams[0].AI.hash,
+                game.teams[1].AI and game.teams[1].AI.hash,
+                ','.join(game.replay.model_hashes))
+        bf = [(game.bf.hash, *row) for row in game.bf.encode()]
+        replay = [(game.hash, *row) for row in game.replay.rows.tolist()]
+        return info, bf, replay
+
+    def add(self, game):
+        """
+        Queue a game to be written. Everything needed is copied out of it here,
+        so it's fine to reuse or throw away the game afterwards
+        :param game: Game, presumably finished
+        :returns: None
+        """
+        self.add_encoded(self.encode(game))
+
+    def add_encoded(self, encoded):
+        """
+        :param encoded: tuple, from encode
+        """
+        if self.closed:
+            raise ValueError('This ReplayStore is closed')
+        self.check()
+        self.queue.put(encoded)
+
+    def writer(self):
+        """
+        Runs in the background thread, which owns the connection
+        """
+        conn = sql.connect(self.fn)
+        conn.execute('PRAGMA journal_mode=WAL;')
+        self.create_tables(conn)
+        conn.commit()
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size and batch[-1] is not None:
+                    batch.append(self.queue.get(timeout=self.timeout))
+            except queue.Empty:
+                pass
+            if None in batch:
+                done = True
+                batch.remove(None)
+            try:
+                if self.error is None and batch:
+                    self.write_batch(conn, batch)
+            except Exception as e:
+                self.error = e
+            finally:
+                for _ in range(len(batch) + done):
+                    self.queue.task_done()
+        conn.close()
+
+    def write_batch(self, conn, batch):
+        """
+        One transaction's worth of games
+        :param batch: list of tuples, from encode
+        """
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO games VALUES (?,?,?,?,?,?,?);',
+                    [info for info, _, _ in batch])
+            conn.executemany('INSERT OR IGNORE INTO battlefield VALUES (?,?,?,?,?);',
+                    [row for _, bf, _ in batch for row in bf])
+            conn.executemany('INSERT INTO replay VALUES (?,?,?,?,?,?,?,?,?);',
+                    [row for _, _, replay in batch for row in replay])
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError(f'Writing replays to {self.fn} failed') from self.error
+
+    def flush(self):
+        """
+        Wait until everything added so far is committed
+        """
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        """
+        Write whatever's left and stop the writer. Safe to call more than once
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
+
+class ReplayReader(object):
+    """
+    Reads the replays a ReplayStore wrote. Opening one makes sure the replay
+    table has an index on (game, turn, step), so finding a moment in a game
+    only means walking back to the nearest keyframe rather than reading the
+    whole table. Moments are (turn, step) pairs, and the state at one is the
+    board after both teams' actions of that step
+    """
+    def __init__(self, fn=None):
+        """
+        :param fn: str, the database file. Default is the same as ReplayStore's
+        """
+        if fn is None:
+            fn = osp.join(osp.dirname(lch.cache_dir), 'games', 'replays.db')
+        self.conn = sql.connect(fn)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS replay_moment ON replay (game, turn, step);')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS replay_keyframe ON replay (game, keyframe, turn, step);')
+        self.conn.commit()
+        self.model_cache = {}
+
+    def close(self):
+        self.conn.close()
+
+    def games(self):
+        """
+        :returns: list of the hashes of every stored game
+        """
+        return [row[0] for row in self.conn.execute('SELECT hash FROM games;')]
+
+    def models(self, game):
+        """
+        :param game: str, the game's hash
+        :returns: list of model game_hashes, in the order of the model indices
+        """
+        if (ret := self.model_cache.get(game)) is None:
+            row = self.conn.execute('SELECT models FROM games WHERE hash=?;', (game,)).fetchone()
+            if row is None:
+                raise KeyError(f'No game {game} in this store')
+            ret = self.model_cache[game] = row[0].split(',')
+        return ret
+
+    def blank_state(self, game):
+        n = len(self.models(game))
+        return GameState(np.full((n, 2), -1, dtype=np.int16), np.zeros(n, dtype=np.int16),
+                np.zeros(n, dtype=np.int8))
+
+    @staticmethod
+    def apply(state, rows):
+        """
+        Update a state in place from (model, health, status, x, y) rows
+        """
+        for m, health, status, x, y in rows:
+            state.health[m] = health
+            state.status[m] = status
+            state.coords[m] = (x, y)
+
+    def state_at(self, game, turn, step):
+        """
+        The board at one moment
+        :param game: str, the game's hash
+        :param turn: int, the turn
+        :param step: int, the step within the turn
+        :returns: GameState, rows in the order of models(game)
+        """
+        state = self.blank_state(game)
+        kf = self.conn.execute("""SELECT turn, step, rowid FROM replay
+            WHERE game=? AND keyframe=1 AND (turn, step) <= (?, ?)
+            ORDER BY turn DESC, step DESC, rowid DESC LIMIT 1;""",
+            (game, turn, step)).fetchone()
+        if kf is None:
+            raise KeyError(f'Nothing recorded in {game} before turn {turn} step {step}')
+        kf_turn, kf_step, kf_row = kf
+        # the keyframe's rows are contiguous, and the last of them is kf_row
+        start = kf_row - len(state.health) + 1
+        self.apply(state, self.conn.execute("""SELECT model, current_health, status, x, y
+            FROM replay WHERE game=? AND (turn, step) >= (?, ?) AND (turn, step) <= (?, ?)
+            AND rowid >= ? ORDER BY turn, step, rowid;""",
+            (game, kf_turn, kf_step, turn, step, start)))
+        return state
+
+    def iter_states(self, game):
+        """
+        Step through a game without loading all of it
+        :param game: str, the game's hash
+        :yields: (turn, step, GameState) for each moment where something
+            changed, in order
+        """
+        state = self.blank_state(game)
+        moment = None
+        for turn, step, *row in self.conn.execute("""SELECT turn, step, model,
+                current_health, status, x, y FROM replay WHERE game=?
+                ORDER BY turn, step, rowid;""", (game,)):
+            if moment is not None and (turn, step) != moment:
+                yield (*moment, state.copy())
+            moment = (turn, step)
+            self.apply(state, [row])
+        if moment is not None:
+            yield (*moment, state.copy())
@@ -35,6 +35,7 @@ class Team(object):
             conn.execute(cmd)
         except Exception as e:
             pass
+        lch.forget_columns('team')
 
     def encode(self, use_game_hash=False):
         """
@@ -50,7 +51,7 @@ class Team(object):
 
     @classmethod
     def from_hash(cls, _hash):
-        return cls.from_tuple(lch.load_from_cache('team', _hash))
+        return cls.from_tuple(lch.catalog.get('team', _hash))
 
     @classmethod
     def from_tuple(cls, args):
@@ -1,4 +1,4 @@
-import random
+import lch
 
 __all__ = 'empty_bf Forest'.split()
 
@@ -6,12 +6,19 @@ def empty_bf(*args):
     return (1,0)
 
 class Forest(object):
-    def __init__(self, size_x, size_y):
+    def __init__(self, size_x, size_y, rng=None):
+        """
+        :param size_x: size of the battlefield in the X direction
+        :param size_y: same, in Y
+        :param rng: a np.random.Generator or seed, see lch.get_rng
+        """
+        rng = lch.get_rng(rng)
         self.tree_locations = set()
         area = (size_x-1) * (size_y-1)
-        num_trees = random.randint(int(area*0.1), int(area*0.33))
+        num_trees = rng.integers(int(area*0.1), int(area*0.33), endpoint=True)
         while len(self.tree_locations) < num_trees:
-            x, y = random.randint(1, size_x-2), random.randint(1, size_y-2)
+            x = int(rng.integers(1, size_x-2, endpoint=True))
+            y = int(rng.integers(1, size_y-2, endpoint=True))
             self.tree_locations.add((x,y))
 
     def __call__(self, x, y):
@@ -0,0 +1,227 @@
+import lch
+import itertools
+from collections import defaultdict
+
+__all__ = 'Tournament RoundRobin Swiss SuccessiveHalving schedulers'.split()
+
+class Tournament(object):
+    """
+    Decides who plays whom. Games happen in rounds: pairings gives the games of
+    the next round, the results go back through report, and once pairings
+    comes back empty the tournament is over and ranking says how it went
+    """
+    # whether ties in the final ranking are broken randomly rather than by
+    # the order of standings
+    random_ties = False
+
+    def __init__(self, ais, rounds=1, rng=None):
+        """
+        :param ais: list of AI hashes
+        :param rounds: int, how long the tournament goes on for, the meaning
+            depends on the subclass
+        :param rng: a np.random.Generator or seed, see lch.get_rng, for tiebreaks
+        """
+        self.ais = list(ais)
+        self.rounds = rounds
+        self.rng = lch.get_rng(rng)
+        self.round_i = 0
+        self.wins = defaultdict(int)
+        self.played = defaultdict(int)
+        self.met = defaultdict(int)
+
+    def pairings(self):
+        """
+        :returns: list of (AI hash, AI hash) for the next round, empty when
+            the tournament is over
+        """
+        raise NotImplementedError()
+
+    def report(self, results):
+        """
+        :param results: iterable of (winning AI hash, losing AI hash)
+        """
+        for w, l in results:
+            self.wins[w] += 1
+            self.played[w] += 1
+            self.played[l] += 1
+            self.met[frozenset((w, l))] += 1
+        self.round_i += 1
+
+    def score(self, ai):
+        return self.wins[ai]/max(self.played[ai], 1)
+
+    def ranking(self):
+        """
+        :returns: list of AI hashes, best first
+        """
+        return sorted(self.ais, key=lambda ai: (self.score(ai), self.wins[ai]), reverse=True)
+
+    def winner(self):
+        return self.ranking()[0]
+
+    def last_round(self):
+        """
+        :returns: bool, whether the round being played is the last one
+        """
+        raise NotImplementedError()
+
+    def standings(self):
+        """
+        :returns: dict of {AI hash: (wins, played)} of everyone still in
+            contention, in the order ties are broken in
+        """
+        return {ai: (self.wins[ai], self.played[ai]) for ai in self.ais}
+
+    def records(self, results, pending):
+        """
+        Where everyone in contention stands partway through a round
+        :param results: list of (winning AI hash, losing AI hash), the games of
+            this round finished so far
+        :param pending: list of (AI hash, AI hash), the games of this round
+            still being played
+        :returns: dict of {AI hash: [wins, played, games left]}, ordered like
+            standings
+        """
+        ret = {ai: [wins, played, 0] for ai, (wins, played) in self.standings().items()}
+        for w, l in results:
+            ret[w][0] += 1
+            ret[w][1] += 1
+            ret[l][1] += 1
+        for a, b in pending:
+            ret[a][2] += 1
+            ret[b][2] += 1
+        return ret
+
+    def decided(self, results, pending):
+        """
+        Whether the tournament's winner is already certain partway through
+        its last round, whatever happens in the games still being played. The
+        leader is the one with the best record if it loses all its remaining
+        games, and it's decided if that still beats every rival winning all
+        of theirs
+        :param results: list of (winning AI hash, losing AI hash), the games of
+            this round finished so far
+        :param pending: list of (AI hash, AI hash), the games of this round
+            still being played
+        :returns: the winner's hash, or None if it could still change or there
+            are more rounds to come
+        """
+        if not self.last_round():
+            return None
+        records = self.records(results, pending)
+        def key(ai, best):
+            wins, played, left = records[ai]
+            if best:
+                wins += left
+            played += left
+            return wins/max(played, 1), wins
+        order = list(records)
+        leader = max(order, key=lambda ai: key(ai, False))
+        worst = key(leader, False)
+        for i, rival in enumerate(order):
+            if rival == leader:
+                continue
+            best = key(rival, True)
+            if worst < best or (worst == best and (self.random_ties or i < order.index(leader))):
+                return None
+        return leader
+
+class RoundRobin(Tournament):
+    """
+    Everyone plays everyone once per round. rounds*n*(n-1)/2 games
+    """
+    def pairings(self):
+        if self.round_i >= self.rounds:
+            return []
+        return list(itertools.combinations(self.ais, 2))
+
+    def last_round(self):
+        return self.round_i + 1 >= self.rounds
+
+class Swiss(Tournament):
+    """
+    Each round, AIs are sorted by score and play a neighbor they've met the
+    fewest times, so games go to deciding between AIs that are doing about as
+    well as each other. rounds*log2(n) rounds of n/2 games. With an odd number
+    of AIs the one at the bottom sits the round out
+    """
+    def __init__(self, ais, rounds=1, rng=None):
+        super().__init__(ais, rounds, rng)
+        self.n_rounds = rounds*max(1, (len(self.ais) - 1).bit_length())
+
+    def last_round(self):
+        return self.round_i + 1 >= self.n_rounds
+
+    def pairings(self):
+        if self.round_i >= self.n_rounds:
+            return []
+        # shuffle first so ties are broken randomly
+        order = [self.ais[i] for i in self.rng.permutation(len(self.ais))]
+        order.sort(key=self.score, reverse=True)
+        ret = []
+        while len(order) > 1:
+            a = order.pop(0)
+            b = min(order, key=lambda x: self.met.get(frozenset((a, x)), 0))
+            order.remove(b)
+            ret.append((a, b))
+        return ret
+
+class SuccessiveHalving(Tournament):
+    """
+    Everyone still in plays rounds games against random others still in, then
+    the bottom half (by record in that bracket) are out. Repeats until one is
+    left, so about rounds*n games per bracket over log2(n) brackets
+    """
+    random_ties = True
+
+    def __init__(self, ais, rounds=1, rng=None):
+        super().__init__(ais, rounds, rng)
+        self.alive = list(self.ais)
+        self.bracket_wins = defaultdict(int)
+        self.bracket_played = defaultdict(int)
+        self.out = []
+
+    def pairings(self):
+        if len(self.alive) < 2:
+            return []
+        ret = []
+        for _ in range(self.rounds):
+            order = [self.alive[i] for i in self.rng.permutation(len(self.alive))]
+            ret += list(zip(order[::2], order[1::2]))
+            if len(order) % 2:
+                # the odd one out still gets their game
+                ret.append((order[-1], order[int(self.rng.integers(len(order)-1))]))
+        return ret
+
+    def last_round(self):
+        return len(self.alive) <= 2
+
+    def standings(self):
+        # only this bracket counts, and only those still in
+        return {ai: (self.bracket_wins[ai], self.bracket_played[ai]) for ai in self.alive}
+
+    def report(self, results):
+        results = list(results)
+        super().report(results)
+        for w, l in results:
+            self.bracket_wins[w] += 1
+            self.bracket_played[w] += 1
+            self.bracket_played[l] += 1
+        key = lambda ai: self.bracket_wins[ai]/max(self.bracket_played[ai], 1)
+        order = [self.alive[i] for i in self.rng.permutation(len(self.alive))]
+        order.sort(key=key, reverse=True)
+        keep = (len(order) + 1)//2
+        self.alive = order[:keep]
+        # knocked out earlier means ranked lower
+        self.out = order[keep:] + self.out
+        self.bracket_wins.clear()
+        self.bracket_played.clear()
+
+    def ranking(self):
+        return self.alive + self.out
+
+schedulers = {
+        'roundrobin': RoundRobin,
+        'swiss': Swiss,
+        'halving': SuccessiveHalving,
+        }
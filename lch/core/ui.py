@@ -2,9 +2,11 @@ import lch
 import tkinter as tk
 from tkinter import ttk
 import time
+from .game import Game
 
+__all__ = 'UI'.split()
 
-class UI(lch.Game):
+class UI(Game):
     """
     Now with something resembling a user interface
     """
@@ -139,8 +141,8 @@ class UI(lch.Game):
 
     def shoot_action(self, action):
         print('Shooting action')
-        s = super().shoot_action(action)
-        self.text_log.set(s)
+        event = super().shoot_action(action)
+        self.text_log.set(str(event))
         if action.target.status == 'dead':
             self.set_square(*action.target.coords, None)
         else:
@@ -148,8 +150,8 @@ class UI(lch.Game):
 
     def melee_action(self, action):
         print('Melee action')
-        s = super().melee_action(action)
-        self.text_log.set(s)
+        event = super().melee_action(action)
+        self.text_log.set(str(event))
         if action.target.status == 'dead':
             self.set_square(*action.target.coords, None)
         else:
@@ -6,28 +6,97 @@ from functools import partial
 from enum import IntEnum
 import numpy as np
 import sqlite3 as sql
+import os
 import os.path as osp
+import pickle
 import inspect
+import threading
 
 
-__all__ = 'get_hash load_from_cache store_in_cache cache_dir db_conn remove_from_cache get_logger PriorityQueue global_vars'.split()
+__all__ = 'get_hash get_rng spawn_seeds load_from_cache store_in_cache store_many forget_columns cache_dir get_db tune_db remove_from_cache remove_many Catalog catalog get_logger PriorityQueue global_vars save_checkpoint load_checkpoint'.split()
 
 global_vars = {}
 cache_dir = osp.dirname(osp.dirname(osp.dirname(inspect.getfile(inspect.currentframe())))) + '/data'
-db_conn = sql.connect(osp.join(cache_dir, 'cache.db'))
+# sqlite connections can only be used by the thread that opened them, so
+# each thread gets its own
+db_local = threading.local()
+# what tune_db set, for connections opened after
+db_pragmas = {}
+
+def get_db():
+    """
+    This thread's connection to cache.db, opened the first time it's needed
+    so importing lch doesn't touch the disk. Also available as lch.db_conn
+    :returns: sqlite3 connection
+    """
+    if (conn := getattr(db_local, 'conn', None)) is None:
+        conn = db_local.conn = sql.connect(osp.join(cache_dir, 'cache.db'))
+        for k, v in db_pragmas.items():
+            conn.execute(f'PRAGMA {k}={v};')
+    return conn
+
+def tune_db(journal_mode='WAL', synchronous='OFF'):
+    """
+    Trade durability for speed, for training where losing the last few writes
+    to a crash doesn't matter much. WAL mode sticks to the database file,
+    synchronous only lasts as long as the connection, so it's also applied
+    to the connections other threads open from then on
+    :param journal_mode: str, see sqlite's journal_mode pragma, default 'WAL'
+    :param synchronous: str, see sqlite's synchronous pragma, default 'OFF'
+    :returns: None
+    """
+    conn = get_db()
+    conn.execute(f'PRAGMA journal_mode={journal_mode};')
+    conn.execute(f'PRAGMA synchronous={synchronous};')
+    db_pragmas['synchronous'] = synchronous
+
+def __getattr__(name):
+    if name == 'db_conn':
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_hash(*args, hash_length=6):
     """
-    Hash a couple of things together
+    Hash a couple of things together. Numpy arrays are hashed straight from
+    their memory rather than through str, after their dtype and shape so
+    arrays with the same bytes but different layouts don't collide
     :param *args: coordsal arguments, things to hash
     :param hash_length: how many characters to return, default 6
     :returns: str, hashed things
     """
     m = hashlib.sha256()
     for arg in args:
-        m.update(str(arg).encode())
+        if isinstance(arg, np.ndarray):
+            m.update(f'{arg.dtype.str}{arg.shape}'.encode())
+            m.update(np.ascontiguousarray(arg).data)
+        else:
+            m.update(str(arg).encode())
     return m.hexdigest()[:hash_length]
 
+def get_rng(seed=None):
+    """
+    Get a random number generator. All randomness in a game should come from
+    one of these rather than the global `random` or `np.random` state
+    :param seed: None, int, SeedSequence, or an existing Generator (which is
+        returned as-is)
+    :returns: np.random.Generator
+    """
+    return np.random.default_rng(seed)
+
+def spawn_seeds(seed, n):
+    """
+    Derive independent child seeds. Unlike SeedSequence.spawn this always returns
+    the same children for the same seed, regardless of how many have been spawned
+    from it already, so a game can be re-simulated from its seed alone
+    :param seed: None, int, or SeedSequence, the parent seed
+    :param n: int, how many children
+    :returns: list of SeedSequence
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (i,),
+            pool_size=seed.pool_size) for i in range(n)]
+
 def load_from_cache(table, _hash, key=None):
     """
     Get an item from a cache
@@ -36,7 +105,7 @@ def load_from_cache(table, _hash, key=None):
     :param key: str, the key of the thing, default is "hash"
     :returns: hopefully the cached thing
     """
-    for row in db_conn.execute(f'SELECT * FROM {table} WHERE {key or "hash"}=?;', (_hash,)):
+    for row in get_db().execute(f'SELECT * FROM {table} WHERE {key or "hash"}=?;', (_hash,)):
         return row
 
 def store_in_cache(cache, thing):
@@ -49,8 +118,52 @@ def store_in_cache(cache, thing):
     if not isinstance(thing, tuple):
         raise ValueError(f'Can only encode tuples, not {type(thing)}')
     qmark = ','.join('?'*len(thing))
-    db_conn.execute(f'INSERT INTO {cache} VALUES ({qmark});', thing)
-    db_conn.commit()
+    conn = get_db()
+    conn.execute(f'INSERT INTO {cache} VALUES ({qmark});', thing)
+    conn.commit()
+    catalog.add(cache, [thing])
+
+table_columns = {}
+
+def forget_columns(cache):
+    """
+    Have store_many look a table's columns up again, after it's been created
+    :param cache: str, the name of the cache
+    :returns: None
+    """
+    table_columns.pop(cache, None)
+
+def store_many(cache, things, replace=False):
+    """
+    Store many items in the db in one transaction. Items with the same key as
+    one already there are skipped, or replace it
+    :param cache: str, the name of the cache you want to store in
+    :param things: iterable of tuples to store
+    :param replace: bool, overwrite existing items, default False
+    :returns: None
+    """
+    conn = get_db()
+    if (columns := table_columns.get(cache)) is None:
+        # (name, primary key or not) of each column
+        columns = [(row[1], row[5] > 0) for row in conn.execute(f'PRAGMA table_info({cache});')]
+        if not columns:
+            # not cached, the table may well be created later
+            raise sql.OperationalError(f'no such table: {cache}')
+        table_columns[cache] = columns
+    things = list(things)
+    for thing in things:
+        if not isinstance(thing, tuple):
+            raise ValueError(f'Can only encode tuples, not {type(thing)}')
+    qmark = ','.join('?'*len(columns))
+    if replace:
+        keys = ','.join(c for c, pk in columns if pk)
+        update = ','.join(f'{c}=excluded.{c}' for c, pk in columns if not pk)
+        conflict = f'ON CONFLICT({keys}) DO UPDATE SET {update}'
+    else:
+        conflict = 'ON CONFLICT DO NOTHING'
+    with conn:
+        conn.executemany(f'INSERT INTO {cache} VALUES ({qmark}) {conflict};', things)
+    catalog.add(cache, things, replace)
 
 def remove_from_cache(cache, _hash, key=None):
     """
@@ -60,8 +173,107 @@ def remove_from_cache(cache, _hash, key=None):
     :param key: str, the key of the thing, default is "hash"
     :returns: None
     """
-    db_conn.execute(f'DELETE FROM {cache} WHERE {key or "hash"}=?;', (_hash,))
-    db_conn.commit()
+    conn = get_db()
+    conn.execute(f'DELETE FROM {cache} WHERE {key or "hash"}=?;', (_hash,))
+    conn.commit()
+    catalog.remove(cache, [_hash], key)
+
+def remove_many(cache, hashes, key=None):
+    """
+    Remove many items from the db in one transaction
+    :param cache: str, the name of the cache
+    :param hashes: iterable of str, the hashes of the things
+    :param key: str, the key of the things, default is "hash"
+    :returns: None
+    """
+    hashes = list(hashes)
+    conn = get_db()
+    with conn:
+        conn.executemany(f'DELETE FROM {cache} WHERE {key or "hash"}=?;', [(h,) for h in hashes])
+    catalog.remove(cache, hashes, key)
+
+class Catalog(object):
+    """
+    The weapon, model and team tables, held in memory. They're small and
+    hardly ever change, so each is read whole the first time anything in it
+    is asked for, and after that setting up a game doesn't touch the db. The
+    functions above that write to the db keep it up to date. AIs come and go
+    far too often to be worth it
+    """
+    tables = ('weapon', 'model', 'team')
+
+    def __init__(self):
+        self.rows = {} # table: {hash: row}
+        self.lock = threading.Lock()
+
+    def load(self, table):
+        """
+        :returns: dict of {hash: row} for the whole table
+        """
+        if (rows := self.rows.get(table)) is None:
+            with self.lock:
+                if (rows := self.rows.get(table)) is None:
+                    rows = {row[0]: row for row in get_db().execute(f'SELECT * FROM {table};')}
+                    self.rows[table] = rows
+        return rows
+
+    def get(self, table, _hash):
+        """
+        Like load_from_cache, for the tables in the catalog
+        :returns: tuple, the row, or None
+        """
+        if table not in self.tables:
+            return load_from_cache(table, _hash)
+        if (row := self.load(table).get(_hash)) is None:
+            # written by another process since the table was read, maybe
+            if (row := load_from_cache(table, _hash)) is not None:
+                self.rows[table][_hash] = row
+        return row
+
+    def add(self, table, rows, replace=True):
+        if (cached := self.rows.get(table)) is None:
+            return
+        for row in rows:
+            if replace or row[0] not in cached:
+                cached[row[0]] = row
+
+    def remove(self, table, hashes, key=None):
+        if table not in self.rows:
+            return
+        if key not in (None, 'hash'):
+            # read it again when it's next needed
+            del self.rows[table]
+            return
+        for h in hashes:
+            self.rows[table].pop(h, None)
+
+    def clear(self):
+        self.rows.clear()
+
+catalog = Catalog()
+
+def save_checkpoint(fn, state):
+    """
+    Pickle something to a file atomically: it's written next to the file and
+    then moved into place, so an interruption leaves either the old checkpoint
+    or the new one and never half of one
+    :param fn: str, the checkpoint file
+    :param state: anything picklable
+    :returns: None
+    """
+    tmp = fn + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, fn)
+
+def load_checkpoint(fn):
+    """
+    The reverse of save_checkpoint
+    """
+    with open(fn, 'rb') as f:
+        return pickle.load(f)
 
 class LogLevels(IntEnum):
     TRACE = 0
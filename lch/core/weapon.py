@@ -1,6 +1,6 @@
 import lch
 import typing as ty
-import random
+import numpy as np
 from enum import IntEnum
 from math import exp
 
@@ -17,6 +17,7 @@ class Weapon(object):
     """
     """
     category = 'none'
+    falloff = False # does damage depend on distance
     def __init__(self, name, _range=1, attacks=1, punch=0, min_damage=0, max_damage=0, _hash=None, owner=None):
         self.name = name
         self.range = _range
@@ -57,13 +58,14 @@ class Weapon(object):
                 max_damage INTEGER);""")
         except Exception as e:
             pass
+        lch.forget_columns('weapon')
 
     @staticmethod
     def from_hash(_hash):
         """
         Takes a hash, returns a Weapon
         """
-        args = lch.load_from_cache('weapon', _hash)
+        args = lch.catalog.get('weapon', _hash)
         cls = getattr(lch, args[2])
         _, name, _, _range, attacks, punch, min_damage, max_damage = args
         return cls(name=name, _range=_range, attacks=attacks, punch=punch,
@@ -88,8 +90,25 @@ class Weapon(object):
     def avg_damage(self):
         return 0.5*sum(self.min_damage, self.max_damage)
 
-    def damage(self, shot_distance):
-        return random.randint(self.min_damage, self.max_damage)
+    def damage(self, shot_distance, rng, size=None):
+        """
+        Roll damage
+        :param shot_distance: how far away the target is
+        :param rng: a np.random.Generator or lch.Dice
+        :param size: int, how many hits to roll for. Default None, which means one
+        :returns: int (or array of ints if size is given), damage before armor
+        """
+        return rng.integers(self.min_damage, self.max_damage, size=size, endpoint=True)
+
+    def damage_pmf(self, shot_distance):
+        """
+        The exact distribution of what damage returns
+        :param shot_distance: how far away the target is
+        :returns: array, element i is the chance of rolling i damage before armor
+        """
+        ret = np.zeros(self.max_damage + 1)
+        ret[self.min_damage:] = 1/(self.max_damage - self.min_damage + 1)
+        return ret
 
 class MeleeWeapon(Weapon):
     def __init__(self, **kwargs):
@@ -163,8 +182,19 @@ class SMG(AssaultWeapon):
     pass
 
 class Shotgun(AssaultWeapon):
-    def damage(self, shot_distance):
-        return int(random.randint(self.min_damage, self.max_damage)*exp(-shot_distance/self.range))
+    falloff = True
+
+    def damage_pmf(self, shot_distance):
+        base = super().damage_pmf(shot_distance)
+        ret = np.zeros_like(base)
+        scale = exp(-shot_distance/self.range)
+        for d, p in enumerate(base):
+            ret[int(d*scale)] += p
+        return ret
+
+    def damage(self, shot_distance, rng, size=None):
+        d = super().damage(shot_distance, rng, size)*exp(-shot_distance/self.range)
+        return int(d) if size is None else d.astype(int)
 
 class Rifle(RangedWeapon):
     pass
@@ -0,0 +1,106 @@
+import lch
+import numpy as np
+from multiprocessing import shared_memory
+
+__all__ = 'WeightArena'.split()
+
+class WeightArena(object):
+    """
+    The weights of a set of AIs packed into one block of shared memory, so all
+    the worker processes on a machine use the same copy instead of decoding
+    their own. The process that makes an arena owns it and unlinks it on
+    close, the others attach to it with its handle and load AIs whose arrays
+    are read-only views into the block
+    """
+    align = 64
+
+    def __init__(self, shm, layout, owner=False):
+        """
+        Use create or attach rather than this
+        :param shm: SharedMemory
+        :param layout: dict of {AI hash: (parent hash, class name, {field: (offset,
+            dtype, shape)} for array fields, {field: value} for the rest)}
+        :param owner: bool, did this process make it
+        """
+        self.shm = shm
+        self.layout = layout
+        self.owner = owner
+
+    @classmethod
+    def create(cls, ais):
+        """
+        Copy some AIs' weights into a new arena
+        :param ais: list of AIs
+        :returns: WeightArena, owned by this process
+        """
+        layout = {}
+        arrays = []
+        size = 0
+        for ai in ais:
+            offsets, values = {}, {}
+            for k in ai.fields():
+                if isinstance(v := getattr(ai, k), np.ndarray):
+                    v = np.ascontiguousarray(v)
+                    offsets[k] = (size, v.dtype.str, v.shape)
+                    arrays.append((size, v))
+                    size += -(-v.nbytes//cls.align)*cls.align
+                else:
+                    values[k] = v
+            layout[ai.hash] = (ai.parent_hash, ai.__class__.__name__, offsets, values)
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for offset, v in arrays:
+            np.ndarray(v.shape, v.dtype, buffer=shm.buf, offset=offset)[...] = v
+        return cls(shm, layout, owner=True)
+
+    @classmethod
+    def attach(cls, handle):
+        """
+        :param handle: from the handle of the arena in the process that made it
+        :returns: WeightArena
+        """
+        name, layout = handle
+        return cls(shared_memory.SharedMemory(name=name), layout)
+
+    @property
+    def handle(self):
+        """
+        What another process needs to attach, small and picklable
+        """
+        return self.shm.name, self.layout
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def hashes(self):
+        return list(self.layout)
+
+    @property
+    def nbytes(self):
+        return self.shm.size
+
+    def load(self, _hash, rng=None):
+        """
+        An AI from the arena, nothing gets copied. The hash is already known so
+        it isn't worked out again either
+        :param _hash: str, the AI's hash
+        :param rng: a np.random.Generator or seed, see lch.get_rng
+        :returns: AI
+        """
+        parent_hash, class_name, offsets, values = self.layout[_hash]
+        kwargs = dict(values)
+        for k, (offset, dtype, shape) in offsets.items():
+            x = np.ndarray(shape, np.dtype(dtype), buffer=self.shm.buf, offset=offset)
+            x.flags.writeable = False
+            kwargs[k] = x
+        return getattr(lch, class_name)(_hash=_hash, parent_hash=parent_hash, rng=rng, **kwargs)
+
+    def close(self):
+        """
+        Detach, and unlink if this process made the arena. Raises BufferError
+        while AIs loaded from it are still around
+        """
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
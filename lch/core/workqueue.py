@@ -0,0 +1,350 @@
+import lch
+import collections
+import os
+import socket
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from .jobs import ai_tuples, ai_cache, register_ais, forget_ais, run_job
+
+__all__ = 'WorkQueue Coordinator run_worker parse_address'.split()
+
+class WorkQueue(object):
+    """
+    The state shared between a Coordinator and its workers. It lives in the
+    coordinator's manager process and everyone else talks to it through a
+    proxy, so every method takes and returns plain picklable things. Jobs are
+    keyed by (batch index, job index). A worker that hasn't been heard from in
+    timeout seconds is presumed dead and its jobs go back in the queue
+    """
+    def __init__(self, timeout=30):
+        """
+        :param timeout: float, seconds of silence before a worker is dead
+        """
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.pending = collections.deque()
+        self.running = {} # key: (worker id, job)
+        self.done = {} # batch index: list of (job index, ok, result) not yet collected
+        self.batch_i = 0
+        self.ais = {}
+        self.evicted = {} # worker id: AI hashes forgotten since it last asked
+        self.last_seen = {}
+        self.names = {}
+        self.next_worker = 0
+        self.closed = False
+
+    # what workers call
+
+    def join(self, name):
+        """
+        :param name: str, something human readable, like the hostname
+        :returns: int, the worker's id
+        """
+        with self.cond:
+            wid = self.next_worker
+            self.next_worker += 1
+            self.names[wid] = name
+            self.last_seen[wid] = time.monotonic()
+            self.evicted[wid] = []
+            return wid
+
+    def heartbeat(self, wid):
+        """
+        :returns: bool, should the worker keep going
+        """
+        with self.cond:
+            self.last_seen[wid] = time.monotonic()
+            return not self.closed
+
+    def get_jobs(self, wid, n):
+        """
+        :param wid: int, the worker's id
+        :param n: int, the most jobs to take
+        :returns: list of (key, GameJob), maybe empty
+        """
+        with self.cond:
+            self.last_seen[wid] = time.monotonic()
+            self.reap()
+            ret = []
+            while self.pending and len(ret) < n:
+                key, job = self.pending.popleft()
+                self.running[key] = (wid, job)
+                ret.append((key, job))
+            return ret
+
+    def put_results(self, wid, results):
+        """
+        :param wid: int, the worker's id
+        :param results: list of (key, ok, what run_job returned or the error)
+        """
+        with self.cond:
+            self.last_seen[wid] = time.monotonic()
+            for key, ok, ret in results:
+                # anything not running any more was requeued or cancelled
+                if self.running.pop(key, None) is not None and key[0] in self.done:
+                    self.done[key[0]].append((key[1], ok, ret))
+            self.cond.notify_all()
+
+    def get_ai(self, _hash):
+        """
+        :returns: the encoded AI, or None if the coordinator wasn't given it
+        """
+        with self.cond:
+            return self.ais.get(_hash)
+
+    def get_evicted(self, wid):
+        """
+        :param wid: int, the worker's id
+        :returns: list of AI hashes the coordinator has forgotten since the
+            last call, for the worker to drop from its caches
+        """
+        with self.cond:
+            ret, self.evicted[wid] = self.evicted.get(wid, []), []
+            return ret
+
+    # what the coordinator calls
+
+    def register_ais(self, tuples):
+        with self.cond:
+            for args in tuples:
+                self.ais[args[0]] = args
+
+    def forget_ais(self, hashes):
+        with self.cond:
+            for h in hashes:
+                self.ais.pop(h, None)
+            for evicted in self.evicted.values():
+                evicted.extend(hashes)
+
+    def submit(self, jobs):
+        """
+        :param jobs: list of GameJobs
+        :returns: int, the batch index
+        """
+        with self.cond:
+            self.batch_i += 1
+            self.done[self.batch_i] = []
+            self.pending.extend(((self.batch_i, i), job) for i, job in enumerate(jobs))
+            return self.batch_i
+
+    def collect(self, batch_i, timeout=1):
+        """
+        Wait for some results of a batch
+        :returns: list of (job index, ok, result), maybe empty
+        """
+        with self.cond:
+            if not self.done[batch_i]:
+                self.cond.wait(timeout)
+            self.reap()
+            ret, self.done[batch_i] = self.done[batch_i], []
+            return ret
+
+    def cancel(self, batch_i):
+        """
+        Forget about a batch, finished or not
+        """
+        with self.cond:
+            self.done.pop(batch_i, None)
+            self.pending = collections.deque(x for x in self.pending if x[0][0] != batch_i)
+            for key in [k for k in self.running if k[0] == batch_i]:
+                del self.running[key]
+
+    def workers(self):
+        """
+        :returns: dict of {worker id: (name, seconds since last heard from)}
+        """
+        with self.cond:
+            now = time.monotonic()
+            return {wid: (self.names[wid], now - t) for wid, t in self.last_seen.items()}
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+
+    def reap(self):
+        """
+        Put the jobs of dead workers back at the front of the queue. Called with
+        the lock held
+        """
+        now = time.monotonic()
+        for wid in [w for w, t in self.last_seen.items() if now - t > self.timeout]:
+            del self.last_seen[wid]
+            self.evicted.pop(wid, None)
+            for key in [k for k, (w, _) in self.running.items() if w == wid]:
+                self.pending.appendleft((key, self.running.pop(key)[1]))
+
+served_queue = None
+
+def init_queue(timeout):
+    global served_queue
+    served_queue = WorkQueue(timeout)
+
+def get_queue():
+    return served_queue
+
+class QueueManager(BaseManager):
+    pass
+
+QueueManager.register('get_queue', callable=get_queue)
+
+def parse_address(s):
+    """
+    :param s: str, "host:port"
+    :returns: (host, port)
+    """
+    host, port = s.rsplit(':', 1)
+    return host, int(port)
+
+class Coordinator(object):
+    """
+    Hands out jobs to workers anywhere that can reach it over TCP, see
+    run_worker. Has the same methods as WorkerPool, so the trainer can use
+    either one
+    """
+    def __init__(self, address=('127.0.0.1', 0), authkey=None, timeout=30):
+        """
+        :param address: (host, port) to listen on, default this machine only on
+            any free port. The one actually used ends up in self.address.
+            Everything sent is pickled, so anyone with the authkey who can reach
+            the port can run code here
+        :param authkey: bytes, workers need the same one. Default a random one,
+            in self.authkey
+        :param timeout: float, seconds of silence before a worker is dead
+        """
+        self.authkey = os.urandom(32) if authkey is None else authkey
+        self.manager = QueueManager(address=address, authkey=self.authkey)
+        self.manager.start(init_queue, (timeout,))
+        self.address = self.manager.address
+        self.queue = self.manager.get_queue()
+        self.batches = {} # batch index: list of jobs
+
+    def register(self, tuples):
+        """
+        Make some AIs available to workers, who fetch them when they need them
+        :param tuples: list of tuples, from AI.encode
+        """
+        self.queue.register_ais(list(tuples))
+
+    def share(self, ais):
+        """
+        Workers on other machines can't see this one's shared memory, so this
+        is register with the AIs encoded
+        :param ais: list of AIs
+        """
+        self.register([ai.encode() for ai in ais])
+
+    def forget(self, hashes):
+        """
+        Drop some AIs, here and, next time they ask for jobs, in the workers
+        :param hashes: iterable of AI hashes
+        """
+        self.queue.forget_ais(list(hashes))
+
+    def submit(self, jobs):
+        """
+        Queue up some jobs without waiting for them
+        :param jobs: list of GameJobs
+        :returns: int, the batch index, for as_completed and cancel
+        """
+        jobs = list(jobs)
+        batch_i = self.queue.submit(jobs)
+        self.batches[batch_i] = jobs
+        return batch_i
+
+    def as_completed(self, batch_i):
+        """
+        :param batch_i: int, from submit
+        :yields: (index into the batch's jobs, what run_job returned), as each job finishes
+        """
+        jobs = self.batches[batch_i]
+        remaining = len(jobs)
+        while remaining:
+            for job_i, ok, ret in self.queue.collect(batch_i):
+                if not ok:
+                    raise RuntimeError(f'Job {jobs[job_i]} failed: {ret}')
+                remaining -= 1
+                yield job_i, ret
+
+    def cancel(self, batch_i):
+        """
+        Forget about a batch, finished or not
+        """
+        if self.batches.pop(batch_i, None) is not None:
+            self.queue.cancel(batch_i)
+
+    def imap_unordered(self, jobs):
+        """
+        Run some jobs
+        :param jobs: list of GameJobs
+        :yields: (index into jobs, what run_job returned), as each job finishes
+        """
+        batch_i = self.submit(jobs)
+        try:
+            yield from self.as_completed(batch_i)
+        finally:
+            self.cancel(batch_i)
+
+    def close(self):
+        """
+        Tell the workers to stop and shut down the server
+        """
+        self.queue.close()
+        # give the workers a heartbeat to notice
+        time.sleep(1)
+        self.manager.shutdown()
+
+def run_worker(address, authkey, batch_size=2, heartbeat=5, running=None):
+    """
+    Play games for a Coordinator until it closes or goes away
+    :param address: (host, port) of the coordinator
+    :param authkey: bytes, the same as the coordinator's
+    :param batch_size: int, how many jobs to take at a time, default 2
+    :param heartbeat: float, seconds between heartbeats, default 5. Should be
+        well under the coordinator's timeout
+    :param running: function that returns False when it's time to stop, or None
+    :returns: int, how many games were played
+    """
+    manager = QueueManager(address=address, authkey=authkey)
+    manager.connect()
+    queue = manager.get_queue()
+    wid = queue.join(socket.gethostname())
+    stop = threading.Event()
+
+    def beat():
+        # proxies open a connection per thread, so this doesn't get in the way
+        while not stop.wait(heartbeat):
+            try:
+                if not queue.heartbeat(wid):
+                    stop.set()
+            except (EOFError, OSError):
+                stop.set()
+    threading.Thread(target=beat, daemon=True).start()
+
+    played = 0
+    try:
+        while not stop.is_set() and (running is None or running()):
+            if evicted := queue.get_evicted(wid):
+                forget_ais(evicted)
+            jobs = queue.get_jobs(wid, batch_size)
+            if not jobs:
+                stop.wait(0.5)
+                continue
+            results = []
+            for key, job in jobs:
+                try:
+                    for h in job.ais:
+                        if h is not None and h not in ai_tuples and h not in ai_cache:
+                            if (args := queue.get_ai(h)) is not None:
+                                register_ais([args])
+                    results.append((key, True, run_job(job)))
+                except Exception as e:
+                    results.append((key, False, repr(e)))
+            queue.put_results(wid, results)
+            played += len(results)
+    except (EOFError, OSError):
+        # the coordinator's gone
+        pass
+    finally:
+        stop.set()
+    return played
@@ -0,0 +1,253 @@
+import lch
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import numpy as np
+
+TEAMS = ['8f74e6', '8f0bbc']
+AI_HASH = '6edfda'
+
+def make_bf(size, seed=0):
+    return lch.Battlefield(*size, lch.Forest(*size, rng=seed))
+
+def clear_caches(bf):
+    bf.astar_cache = {}
+    bf.los_cache = {}
+
+def make_game(size, team_size=6, seed=0, ais=(AI_HASH, AI_HASH)):
+    """
+    A headless game on a fixed map, with only the first team_size models of
+    each team
+    """
+    g = lch.Game(TEAMS, list(ais), make_bf(size, seed), seed=seed, sink=lch.NullSink())
+    if team_size < len(g.teams[0].models):
+        g.teams = [lch.Team(models=t.models[:team_size], ai=t.AI) for t in g.teams]
+        g.models = g.teams[0].models + g.teams[1].models
+        g.replay = lch.ReplayRecorder(g.models)
+        g.replay.record(0, 0, g.clone())
+    return g
+
+def point_pairs(bf, n, seed=0):
+    """
+    Pairs of open squares, the same ones every time
+    """
+    rng = lch.get_rng(seed)
+    open_squares = sorted(xy for xy, sq in bf.cache.items() if sq.move_scale != -1)
+    idx = rng.integers(len(open_squares), size=(n, 2))
+    return [(open_squares[a], open_squares[b]) for a, b in idx]
+
+# Each benchmark is a function returning (setup, run). setup is called before
+# every repetition and isn't timed, its return value is passed to run
+
+def bench_priority_queue(n=2000):
+    priorities = lch.get_rng(0).random(n).tolist()
+    def run(_):
+        q = lch.PriorityQueue(-1, 0)
+        for i, p in enumerate(priorities):
+            q.put(i, p)
+        while not q.empty:
+            q.get()
+    return (lambda: None), run
+
+def bench_astar(size):
+    bf = make_bf(size)
+    pairs = point_pairs(bf, 50)
+    def setup():
+        clear_caches(bf)
+    def run(_):
+        for start, end in pairs:
+            bf.astar_path(start, end)
+    return setup, run
+
+def bench_reachable(size, move=6):
+    bf = make_bf(size)
+    starts = [a for a, _ in point_pairs(bf, 50)]
+    def run(_):
+        for start in starts:
+            for _ in bf.reachable(start, move):
+                pass
+    return (lambda: None), run
+
+def bench_los_range(size):
+    bf = make_bf(size)
+    pairs = point_pairs(bf, 200)
+    def setup():
+        clear_caches(bf)
+    def run(_):
+        for start, end in pairs:
+            bf.los_range(start, end)
+    return setup, run
+
+def bench_battlefield(size):
+    forest = lch.Forest(*size, rng=0)
+    def run(_):
+        lch.Battlefield(*size, forest)
+    return (lambda: None), run
+
+def bench_generate_actions(size, team_size):
+    g = make_game(size, team_size)
+    def setup():
+        clear_caches(g.bf)
+    def run(_):
+        g.teams[0].generate_actions(g.teams[1], g.bf)
+    return setup, run
+
+def bench_normalize_input(size):
+    g = make_game(size)
+    actions = g.teams[0].generate_actions(g.teams[1], g.bf)
+    ai = g.teams[0].AI
+    def run(_):
+        ai.normalize_input(actions)
+    return (lambda: None), run
+
+def bench_select_action(size):
+    g = make_game(size)
+    actions = g.teams[0].generate_actions(g.teams[1], g.bf)
+    ai = g.teams[0].AI
+    def setup():
+        ai.rng = lch.get_rng(0)
+    def run(_):
+        ai.select_action(actions)
+    return setup, run
+
+def bench_mcts(size, workers, iterations=200):
+    """
+    One MCTS decision from the start of a game, from a new tree each time.
+    The pool of a parallel search is started before the timing, the way it
+    would be after the first decision of a game
+    """
+    ai = lch.MCTS.from_scratch(rng=0, iterations=iterations, workers=workers)
+    g = make_game(size, ais=(ai, AI_HASH))
+    g.start_of_turn(1)
+    ai = g.teams[0].AI
+    actions = g.teams[0].generate_actions(g.teams[1], g.bf)
+    ai.select_action(actions)
+    def setup():
+        ai.root, ai.rng = None, lch.get_rng(0)
+    def run(_):
+        ai.select_action(actions)
+    return setup, run
+
+def bench_game_loop(size, team_size):
+    def setup():
+        return make_game(size, team_size)
+    def run(g):
+        g.game_loop()
+    return setup, run
+
+def benchmarks(quick=False):
+    """
+    :returns: dict of {name: (factory, args, repeats)}
+    """
+    sizes = [(16, 10), (20, 12), (28, 18)]
+    ret = {'priority_queue': (bench_priority_queue, (), 20)}
+    for s in sizes:
+        tag = f'{s[0]}x{s[1]}'
+        ret[f'astar/{tag}'] = (bench_astar, (s,), 10)
+        ret[f'reachable/{tag}'] = (bench_reachable, (s,), 10)
+        ret[f'los_range/{tag}'] = (bench_los_range, (s,), 10)
+        ret[f'battlefield/{tag}'] = (bench_battlefield, (s,), 10)
+    for n in [2, 4, 6]:
+        ret[f'generate_actions/20x12/{n}v{n}'] = (bench_generate_actions, ((20, 12), n), 5)
+    ret['normalize_input/20x12'] = (bench_normalize_input, ((20, 12),), 20)
+    ret['select_action/20x12'] = (bench_select_action, ((20, 12),), 20)
+    for w in [1, 2, 4]:
+        ret[f'mcts/12x10/{w}workers'] = (bench_mcts, ((12, 10), w), 3)
+    games = [((16, 10), 2), ((20, 12), 4)] if quick else [
+            ((16, 10), 2), ((16, 10), 6), ((20, 12), 4), ((20, 12), 6), ((28, 18), 6)]
+    for s, n in games:
+        ret[f'game_loop/{s[0]}x{s[1]}/{n}v{n}'] = (bench_game_loop, (s, n), 1 if quick else 3)
+    return ret
+
+def measure(setup, run, repeats):
+    """
+    :returns: dict of timings in seconds
+    """
+    times = []
+    for _ in range(repeats):
+        arg = setup()
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+    return {'median': statistics.median(times), 'min': min(times), 'max': max(times),
+            'repeats': repeats}
+
+def compare(results, baseline, threshold, min_delta=0.):
+    """
+    Compares the fastest of each benchmark's runs, which noise from the rest
+    of the machine can only ever slow down
+    :param threshold: float, how much slower counts as a regression, and how
+        much faster counts as faster
+    :param min_delta: float, seconds. Differences smaller than this are
+        ignored, for benchmarks so short that timer jitter is most of them
+    :returns: list of (name, ratio) for benchmarks more than threshold slower
+    """
+    ret = []
+    for name, r in results.items():
+        if (b := baseline.get(name)) is None:
+            continue
+        ratio = r['min']/b['min']
+        flag = ''
+        if abs(r['min'] - b['min']) < min_delta:
+            pass
+        elif ratio > 1 + threshold:
+            ret.append((name, ratio))
+            flag = '  REGRESSION'
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print(f'{name:<32} {1e3*b["min"]:>10.2f} ms -> {1e3*r["min"]:>10.2f} ms '
+              f'({ratio:.2f}x){flag}')
+    return ret
+
+def meta():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'python': sys.version.split()[0], 'numpy': np.__version__,
+            'platform': platform.platform(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+def main():
+    parser = argparse.ArgumentParser(description=('Times the hot paths of the engine '
+        'on fixed maps with fixed seeds, so runs on the same machine can be compared. '
+        'Results are written as JSON, and compared against a baseline from an '
+        'earlier run if given'))
+    parser.add_argument('--output', default=None, help='File to write the results to')
+    parser.add_argument('--baseline', default=None, help='Results of an earlier run to compare to')
+    parser.add_argument('--threshold', default=0.1, type=float,
+            help=('How much slower than the baseline the fastest run has to be to count as a '
+                'regression, default 0.1 (10%%)'))
+    parser.add_argument('--min-delta', default=0.05, type=float,
+            help='Milliseconds of difference too small to count either way, default 0.05')
+    parser.add_argument('--filter', default='', help='Only run benchmarks whose name contains this')
+    parser.add_argument('--quick', action='store_true', help='Fewer and shorter full games')
+    args = parser.parse_args()
+
+    results = {}
+    for name, (factory, fargs, repeats) in benchmarks(args.quick).items():
+        if args.filter not in name:
+            continue
+        setup, run = factory(*fargs)
+        results[name] = measure(setup, run, repeats)
+        print(f'{name:<32} {1e3*results[name]["min"]:>10.2f} ms')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta(), 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f'\nCompared to {baseline["meta"].get("commit")} from {baseline["meta"].get("time")}')
+        if regressions := compare(results, baseline['results'], args.threshold,
+                args.min_delta/1e3):
+            print(f'{len(regressions)} regressions')
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
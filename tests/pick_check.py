@@ -0,0 +1,30 @@
+import lch
+import argparse
+import collections
+import numpy as np
+
+def main():
+    parser = argparse.ArgumentParser(description=('Checks that AI.pick copes with scores of '
+        'both signs, as come out of the tanh of a DenseMultilayer: only the top_n best '
+        'are picked, and better ones more often'))
+    parser.add_argument('--draws', default=20000, type=int)
+    args = parser.parse_args()
+
+    ai = lch.DenseMultilayer.from_scratch(rng=0)
+    scores = np.array([0.5, -0.2, 0.9, -0.8, -0.95])
+    for top_n in [1, 2, 3, 5]:
+        ai.top_n, ai.rng = top_n, lch.get_rng(1)
+        counts = collections.Counter(int(ai.pick(scores.copy())) for _ in range(args.draws))
+        best = list(np.argsort(scores)[::-1][:top_n])
+        assert set(counts) <= set(best), f'top_n={top_n} picked {sorted(counts)}, not only {best}'
+        freq = [counts[i] for i in best]
+        assert freq == sorted(freq, reverse=True), f'top_n={top_n}: {freq} for {best}'
+        print(f'top_n={top_n}: {dict(sorted(counts.items()))}')
+    # with every action in the running, the chances are the scores mapped
+    # from [-1, 1] to [0, 1]
+    weights = (scores + 1)/2
+    expected = args.draws*weights/weights.sum()
+    assert np.abs(np.array([counts[i] for i in range(len(scores))]) - expected).max() < 0.05*args.draws
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import lch
+import argparse
+import numpy as np
+
+def collect_inputs(ai, teams, games, seed):
+    """
+    Play some games and record the normalized actions of every decision the
+    AI makes
+    :param ai: an AI, playing both sides
+    :returns: list of arrays, as from AI.normalize_input
+    """
+    inputs = []
+    for game_seed in lch.spawn_seeds(seed, games):
+        map_seed, game_seed = lch.spawn_seeds(game_seed, 2)
+        size_x, size_y = 20, 12
+        bf = lch.Battlefield(size_x, size_y, lch.Forest(size_x, size_y, rng=map_seed))
+        g = lch.Game(teams, [ai, ai], bf, seed=game_seed, sink=lch.NullSink())
+        for team in g.teams:
+            normalize = team.AI.normalize_input
+            def recording_normalize(actions, normalize=normalize):
+                normed = normalize(actions)
+                inputs.append(normed)
+                return normed
+            team.AI.normalize_input = recording_normalize
+        g.game_loop()
+    return inputs
+
+def nbytes(ai):
+    return sum(x.nbytes for x in map(lambda k: getattr(ai, k), ai.fields())
+            if isinstance(x, np.ndarray))
+
+def main():
+    parser = argparse.ArgumentParser(description=('How much does quantizing an '
+        'AI change its decisions? Plays some games with the full-precision AI, '
+        'then replays every decision through the quantized versions'))
+    parser.add_argument('--ai', default=None,
+            help='Hash of the AI to check, default a new one and a mutation of it')
+    parser.add_argument('--games', default=3, type=int, help='Number of games to sample decisions from')
+    parser.add_argument('--seed', default=0, type=int, help='Seed for maps and games')
+    args = parser.parse_args()
+
+    if args.ai is None:
+        ai = lch.DenseMultilayer.from_scratch(rng=args.seed)
+        ais = [ai, ai.mutate()]
+    else:
+        ais = [lch.AI.from_hash(args.ai)]
+    for ai in ais:
+        weights = np.concatenate([x.ravel() for x in map(lambda k: getattr(ai, k), ai.fields())
+            if isinstance(x, np.ndarray) and x.dtype.kind == 'f'])
+        if np.ptp(weights) == 0:
+            print(f'Warning: every weight of {ai.hash} is {weights[0]}, so quantizing it changes nothing')
+        inputs = collect_inputs(ai, ['8f74e6', '8f0bbc'], args.games, args.seed)
+        print(f'{ai.hash}: {len(inputs)} decisions, full precision uses {nbytes(ai)} bytes')
+        for mode in ['float16', 'int8']:
+            agreement, max_err = lch.quantization_agreement(ai, inputs, mode)
+            print(f'  {mode}: {nbytes(ai.quantize(mode))} bytes, same action {100*agreement:.1f}% '
+                  f'of the time, max score change {max_err:.2g}')
+
+if __name__ == '__main__':
+    main()
@@ -31,10 +31,10 @@ def setup_weapons():
         lch.Weapon.create_table(lch.db_conn)
     except sql.OperationalError:
         print('Table exists')
-    for wep in weps:
-        w = lch.Weapon.from_tuple(wep)
+    ws = [lch.Weapon.from_tuple(wep) for wep in weps]
+    for w in ws:
         print(w.name, w.hash)
-        lch.store_in_cache('weapon', w.encode())
+    lch.store_many('weapon', [w.encode() for w in ws])
 
 def setup_models():
     try:
@@ -54,10 +54,10 @@ def setup_models():
     mods = [
             model() for _ in range(6)
             ]
-    for mod in mods:
-        m = lch.Model.from_tuple((None, *mod))
+    ms = [lch.Model.from_tuple((None, *mod)) for mod in mods]
+    for m in ms:
         print(m.hash)
-        lch.store_in_cache('model', m.encode())
+    lch.store_many('model', [m.encode() for m in ms])
 
 model_hashes = 'eb03ac ef1859 cf2722 0bcae4 fa6fe1 3078b4'.split()
 
@@ -68,11 +68,8 @@ def setup_ais():
         #print('Table exists')
         pass
     ai = lch.DenseMultilayer.from_scratch()
-    try:
-        lch.store_in_cache('ai', ai.encode())
-    except:
-        # why do I need this try-except?
-        pass
+    # already there if it's been made before
+    lch.store_many('ai', [ai.encode()])
     return ai.hash
 
 def setup_teams():
@@ -87,9 +84,10 @@ def setup_teams():
         #print('Table exists')
         pass
 
+    teams = []
     for t in [make_team(0), make_team(1)]:
         print(t)
-        team = lch.Team.from_tuple(t)
-        print(team.hash)
-        lch.store_in_cache('team', team.encode())
+        teams.append(lch.Team.from_tuple(t))
+        print(teams[-1].hash)
+    lch.store_many('team', [team.encode() for team in teams])
     return
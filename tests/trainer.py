@@ -1,15 +1,12 @@
 import lch
 from test_inst import *
 import argparse
+import copy
 import tqdm
-import itertools
 import os
-from concurrent.futures import ProcessPoolExecutor as pool_exec
 import signal
-from collections import defaultdict
-
-def play(game):
-    return game.game_loop()
+import time
+import numpy as np
 
 class SignalHandler(object):
     def __init__(self):
@@ -22,107 +19,311 @@ class SignalHandler(object):
 
 sh = SignalHandler()
 
-def generation_multithread(teams, ais, rounds, workers):
-    results = defaultdict(int)
-    n_games = (rounds * len(ais) * (len(ais)-1) // 2)
-    while sh.run == True:
-        for _ in range(rounds):
-            size_x, size_y = 20, 12
-            bf = lch.Battlefield(size_x, size_y, lch.Forest(size_x, size_y))
-            games = []
-            for ai in itertools.combinations(ais, 2):
-                # generate a game of each AI against each other AI on this map
-                games.append(lch.Game(teams, ai, bf))
-        try:
-            with pool_exec(max_workers=workers) as executor:
-                for (i,j) in executor.map(play, games):
-                    results[i] += 1
-                    if not sh.run:
-                        break
-        except Exception as e:
-            tqdm.tqdm.write(f'Caught a {type(e)}: {e}, continuing')
-        if sum(results.values()) == n_games:
-            break
-    return results
-
-def generation_singlethread(teams, ais, rounds):
-    results = defaultdict(int)
-    games = []
-    for _ in range(rounds):
-        # generate a map
-        size_x, size_y = 20, 12
-        bf = lch.Battlefield(size_x, size_y, lch.Forest(size_x, size_y))
-
-        for ai in itertools.combinations(ais, 2):
-            # generate a game of each AI against each other AI on this map
-            games.append(lch.Game(teams, ai, bf))
-
-    for g in tqdm.tqdm(games, leave=False, desc='Games'):
-        results[g.game_loop()[0]] += 1
-        if not sh.run:
-            break
+def make_jobs(teams, pairings, seed, store=False, metrics=False):
+    """
+    Describe a map and a game for each pairing on it. Maps and games get their
+    own seeds derived from the round's seed, so any of them can be regenerated
+    on its own. Whoever runs a job builds the map and loads the AIs, so only
+    the seeds and hashes travel between processes
+    :param pairings: list of (AI hash, AI hash)
+    :param seed: SeedSequence for this round
+    :param store: bool, return encoded replays
+    :param metrics: bool, measure the games and return the measurements
+    :returns: list of GameJobs
+    """
+    map_seed, game_seed = lch.spawn_seeds(seed, 2)
+    size = (20, 12)
+    return [lch.GameJob(map_seed, size, tuple(teams), ai, s, store, metrics)
+            for ai, s in zip(pairings, lch.spawn_seeds(game_seed, len(pairings)))]
 
-    return results
+def submit_round(teams, tournament, seed, pool, store=None, metrics=None):
+    """
+    Start the next round of a tournament on the pool without waiting for it
+    :returns: (pairings, jobs, batch index), or None if the tournament is over
+    """
+    if not (pairings := tournament.pairings()):
+        return None
+    round_seed = lch.spawn_seeds(seed, tournament.round_i+1)[-1]
+    jobs = make_jobs(teams, pairings, round_seed, bool(store), metrics is not None)
+    return pairings, jobs, pool.submit(jobs)
+
+def play_generation(teams, tournament, seed, pool=None, store=None, ratings=None,
+        checkpoint=None, metrics=None, first_round=None, on_decided=None):
+    """
+    Play out a tournament, one round at a time. A round that gets interrupted
+    doesn't count, the tournament is left as it was after the last full round
+    :param tournament: a Tournament
+    :param seed: SeedSequence for this generation, each round gets a child
+    :param pool: a WorkerPool or Coordinator, or None to play everything in this process
+    :param store: a ReplayStore, or None
+    :param ratings: a RatingStore to update after each round, or None
+    :param checkpoint: function to call after each round, or None
+    :param metrics: list to add each game's Metrics snapshot to, or None to not measure
+    :param first_round: what submit_round returned, if the first round is already
+        on the pool, or None
+    :param on_decided: function to call with the winner's hash as soon as the games
+        still being played can't change it, or None. Needs a pool
+    :returns: the tournament
+    """
+    while sh.run:
+        if pool is None:
+            if not (pairings := tournament.pairings()):
+                break
+            round_seed = lch.spawn_seeds(seed, tournament.round_i+1)[-1]
+            jobs = make_jobs(teams, pairings, round_seed, bool(store), metrics is not None)
+            outcomes = enumerate(map(lch.run_job, tqdm.tqdm(jobs, leave=False, desc='Games')))
+        else:
+            if first_round is None:
+                first_round = submit_round(teams, tournament, seed, pool, store, metrics)
+            if first_round is None:
+                break
+            (pairings, jobs, batch_i), first_round = first_round, None
+            outcomes = pool.as_completed(batch_i)
+        results = [None]*len(jobs)
+        try:
+            for i, (result, replay, measured) in outcomes:
+                results[i] = result
+                if metrics is not None:
+                    metrics.append(measured)
+                if store:
+                    store.add_encoded(replay)
+                if not sh.run:
+                    return tournament
+                if on_decided is not None:
+                    pending = [p for p, r in zip(pairings, results) if r is None]
+                    if pending and (leader := tournament.decided(
+                            [r for r in results if r is not None], pending)) is not None:
+                        on_decided(leader)
+                        on_decided = None
+        finally:
+            if pool is not None:
+                pool.cancel(batch_i)
+        tournament.report(results)
+        if ratings is not None:
+            ratings.record(results)
+        if checkpoint is not None:
+            checkpoint()
+    return tournament
 
 def main():
     parser = argparse.ArgumentParser(description=('A training program for Last Chance '
         'Heroes. Each generation, a number of AIs are created equal to the '
-        '"agents" argument, and a number of maps equal to the "rounds" argument. '
-        'Each AI plays each other AI on each map, so the number of games per '
-        'generation is rounds * agents * (agents-1)/2. The AI that wins the most '
+        '"agents" argument, and they play a tournament with a new map each round. '
+        'With the default round robin scheduler each AI plays each other AI on each '
+        'map, so the number of games per generation is rounds * agents * (agents-1)/2. '
+        'Swiss and successive halving tournaments need far fewer games for large '
+        'populations. The AI that tops the tournament '
         'in one generation is mutated to form the agents for the next generation. '
         'The winner is immortalized while the losers are forgotten. '
         'This is bloodsport, you win or you die'))
-    parser.add_argument('--rounds', default=5, type=int, help='Number of games per agent pairing')
+    parser.add_argument('--rounds', default=5, type=int,
+            help='Number of games per agent pairing, or per agent per bracket for the other schedulers')
+    parser.add_argument('--scheduler', default='roundrobin', choices=list(lch.schedulers),
+            help='How to decide who plays whom')
     parser.add_argument('--agents', default=5, type=int, help='Number of agents per generation.')
     parser.add_argument('--generations', default=5, type=int, help='Number of generations')
     parser.add_argument('--threads', default=1, help='Number of CPUs to train with. Int or "all"')
     parser.add_argument('--start-from', type=str, default='scratch',
             help='An AI to start from. "scratch" or a hash')
+    parser.add_argument('--seed', type=int, default=None,
+            help='Root seed for the whole run. Default is fresh entropy, which gets printed')
+    parser.add_argument('--store', action='store_true',
+            help='Store replays of every game in games/replays.db')
+    parser.add_argument('--hall-of-fame', default=0, type=int,
+            help='Number of the highest rated AIs to keep instead of forgetting')
+    parser.add_argument('--opponents', default=0, type=int,
+            help='Number of hall of fame AIs to add to each generation')
+    parser.add_argument('--checkpoint', default=None,
+            help='File to save progress to after every round of games, default none')
+    parser.add_argument('--resume', action='store_true',
+            help='Carry on from the checkpoint file, with the settings it was started with')
+    parser.add_argument('--serve', default=None, metavar='HOST:PORT',
+            help=('Hand games out to workers connecting on this address instead of playing them here. '
+                'Use a host only trusted machines can reach, 0.0.0.0 is every interface'))
+    parser.add_argument('--worker', default=None, metavar='HOST:PORT',
+            help='Play games for the trainer serving on this address, instead of training')
+    parser.add_argument('--authkey', default=None,
+            help='Shared secret between --serve and --worker. --serve makes one up and prints it if not given')
+    parser.add_argument('--metrics', action='store_true',
+            help='Time the engine and report throughput every generation')
+    parser.add_argument('--fast-db', action='store_true',
+            help='Put cache.db in WAL mode and stop syncing it to disk after every write')
+    parser.add_argument('--pipeline', action='store_true',
+            help=('Breed the next generation and start its games as soon as the winner of '
+                'this one is certain, rather than waiting for the last games to finish. '
+                'Not with --opponents, which are picked from ratings that aren\'t final yet'))
 
     args = parser.parse_args()
+    if args.worker is not None:
+        if args.authkey is None:
+            parser.error('--worker needs the --authkey the trainer is serving with')
+        played = lch.run_worker(lch.parse_address(args.worker), args.authkey.encode(),
+                running=lambda: sh.run)
+        tqdm.tqdm.write(f'Played {played} games')
+        return
+    state = None
+    if args.resume:
+        if args.checkpoint is None:
+            parser.error('--resume needs the --checkpoint file to carry on from')
+        state = lch.load_checkpoint(args.checkpoint)
+        # the run carries on as it was started, apart from where it's running
+        for k, v in state['args'].items():
+            if k not in ['threads', 'checkpoint', 'resume', 'serve', 'authkey', 'metrics', 'pipeline',
+                    'fast_db']:
+                setattr(args, k, v)
+    if args.pipeline and args.opponents > 0:
+        # the next generation's opponents would be sampled before this one's
+        # ratings are in, so the run could differ from one without --pipeline
+        parser.error('--pipeline can\'t be used with --opponents')
     if args.threads in ['all', 'max']:
         args.threads = os.cpu_count()
     else:
         args.threads = int(args.threads)
-    if args.start_from == 'scratch':
+    if state is not None:
+        top_hash = state['winner']
+    elif args.start_from == 'scratch':
         top_hash = setup_ais()
     else:
         top_hash = args.start_from
 
     teams = ['8f74e6', '8f0bbc']
+    root_seed = np.random.SeedSequence(args.seed if state is None else state['entropy'])
+    tqdm.tqdm.write(f'Root seed: {root_seed.entropy}')
+    gen_seeds = lch.spawn_seeds(root_seed, args.generations)
+    store = lch.ReplayStore() if args.store else None
+    # workers stay up for the whole run so they keep their caches
+    if args.serve is not None:
+        authkey = os.urandom(16).hex() if args.authkey is None else args.authkey
+        pool = lch.Coordinator(lch.parse_address(args.serve), authkey.encode())
+        tqdm.tqdm.write(f'Serving games on {pool.address[0]}:{pool.address[1]}, authkey {authkey}')
+    elif args.threads > 1:
+        pool = lch.WorkerPool(args.threads)
+    else:
+        pool = None
+    if args.fast_db:
+        lch.tune_db()
+    ratings = lch.RatingStore()
+    start_gen = 0 if state is None else state['gen_i']
+    # the AIs this run made, the only ones it prunes. The rest of the
+    # cache, like winners of earlier runs, is left alone
+    created = set() if state is None else set(state.get('created', ()))
+    if start_gen > 0:
+        winner = lch.AI.from_hash(top_hash)
+
+    def checkpoint(gen_i, ais=None, tournament=None):
+        if args.checkpoint is None:
+            return
+        lch.save_checkpoint(args.checkpoint, {'args': vars(args), 'entropy': root_seed.entropy,
+            'gen_i': gen_i, 'winner': top_hash, 'ais': ais, 'tournament': tournament,
+            'created': sorted(created)})
 
-    for gen_i in tqdm.trange(args.generations, desc='Generations'):
+    def breed(gen_i, winner, early=False):
+        """
+        Make a generation's AIs from the last one's winner and set up its tournament
+        :param early: bool, the last generation is still going, so leave rating
+            the new AIs until this one starts
+        :returns: (list of AI hashes of the new AIs, list of AI hashes of
+            everyone playing, the Tournament)
+        """
+        breed_seed, _, schedule_seed = lch.spawn_seeds(gen_seeds[gen_i], 3)
+        rng = lch.get_rng(breed_seed)
         if gen_i == 0:
-            ais = [lch.DenseMultilayer.from_scratch() for _ in range(args.agents)]
+            ais = [lch.DenseMultilayer.from_scratch(rng=rng) for _ in range(args.agents)]
         else:
-            ais = [winner] + [winner.mutate() for _ in range(args.agents//2)] + [lch.DenseMultilayer.from_scratch() for _ in range(args.agents//2)]
+            winner.rng = rng
+            ais = [winner] + winner.mutate_batch(args.agents//2) + [lch.DenseMultilayer.from_scratch(rng=rng) for _ in range(args.agents//2)]
+        # only what wasn't in the cache already, the last winner may have come
+        # from another run as an opponent and AIs from scratch can repeat
+        hashes = [ai.hash for ai in ais]
+        existing = {h for h, in lch.get_db().execute(
+            f'SELECT hash FROM ai WHERE hash IN ({",".join("?"*len(hashes))});', hashes)}
+        created.update(h for h in hashes if h not in existing)
 
-        for ai in ais:
-            try:
-                lch.store_in_cache('ai', ai.encode())
-            except:
-                pass
-        ais = [ai.hash for ai in ais]
+        lch.store_many('ai', [ai.encode() for ai in ais])
+        if pool is not None:
+            pool.share(ais)
+        bred = [ai.hash for ai in ais]
+        if not early:
+            ratings.enter(bred)
+        ais = bred + ratings.sample(args.opponents, rng, pool_size=args.hall_of_fame, exclude=bred)
+        return bred, ais, lch.schedulers[args.scheduler](ais, args.rounds, rng=schedule_seed)
 
-        # fight to the death for our amusement
-        if args.threads > 1:
-            results = generation_multithread(ais, teams, args.rounds, args.threads)
+    # the next generation, started while the last games of this one finish
+    ahead = None
+
+    def start_next(gen_i, leader):
+        nonlocal ahead
+        if gen_i >= args.generations:
+            return
+        before = set(created)
+        bred, ais, tournament = breed(gen_i, lch.AI.from_hash(leader), early=True)
+        # what gets checkpointed is the tournament before its first pairings
+        fresh = copy.deepcopy(tournament)
+        game_seed = lch.spawn_seeds(gen_seeds[gen_i], 3)[1]
+        ahead = (leader, bred, created - before, ais, fresh, tournament,
+                submit_round(teams, tournament, game_seed, pool, store, measured))
+
+    def abandon():
+        # the leader changed or the run stopped, undo what start_next did
+        nonlocal ahead
+        leader, bred, new, _, _, _, first_round = ahead
+        if first_round is not None:
+            pool.cancel(first_round[2])
+        pool.forget([h for h in bred if h != leader])
+        # anything that was in the cache before start_next stays there
+        created.difference_update(new)
+        lch.remove_many('ai', list(new))
+        ahead = None
+
+    for gen_i in tqdm.trange(start_gen, args.generations, desc='Generations'):
+        game_seed = lch.spawn_seeds(gen_seeds[gen_i], 3)[1]
+        first_round = None
+        if state is not None and state['tournament'] is not None:
+            # pick up partway through the generation
+            ais, tournament = state['ais'], state['tournament']
+        elif ahead is not None:
+            _, bred, _, ais, fresh, tournament, first_round = ahead
+            ahead = None
+            ratings.enter(bred)
+            checkpoint(gen_i, ais, fresh)
         else:
-            results = generation_singlethread(ais, teams, args.rounds)
-
-        top_hash, top_wins = None, 0
-        for k, v in results.items():
-            if v > top_wins:
-                top_hash = k
-                top_wins = v
-
-        # losers get forgotten
-        for ai in ais:
-            if ai != top_hash:
-                lch.remove_from_cache('ai', ai)
-            else:
-                winner = lch.AI.from_hash(ai)
+            _, ais, tournament = breed(gen_i, winner if gen_i > 0 else None)
+            checkpoint(gen_i, ais, tournament)
+        state = None
+
+        # fight to the death for our amusement
+        measured = [] if args.metrics else None
+        t_start = time.perf_counter()
+        on_decided = None
+        if args.pipeline and pool is not None:
+            on_decided = lambda leader: start_next(gen_i+1, leader)
+        play_generation(teams, tournament, game_seed, pool, store, ratings,
+                lambda: checkpoint(gen_i, ais, tournament), measured, first_round, on_decided)
+        if args.metrics:
+            tqdm.tqdm.write(f'Generation {gen_i}: ' + lch.Metrics.report(
+                lch.Metrics.merge(*measured), time.perf_counter() - t_start))
+        if not sh.run:
+            if ahead is not None:
+                abandon()
+            if args.checkpoint is not None:
+                tqdm.tqdm.write(f'Interrupted, carry on with --resume --checkpoint {args.checkpoint}')
+            break
+        top_hash = tournament.winner()
+        if ahead is not None and ahead[0] != top_hash:
+            abandon()
+        keep = [top_hash] + ([] if ahead is None else ahead[3])
+
+        # losers get forgotten, unless they're rated well enough for the hall of fame
+        lch.remove_many('ai', ratings.prune(args.hall_of_fame, protect=keep, among=created))
+        winner = lch.AI.from_hash(top_hash)
+        if pool is not None:
+            pool.forget([ai for ai in ais if ai not in keep])
+        checkpoint(gen_i+1)
+
+    if pool is not None:
+        pool.close()
+    if store is not None:
+        store.close()
 
 if __name__ == '__main__':
     main()
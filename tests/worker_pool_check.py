@@ -0,0 +1,67 @@
+import lch
+import argparse
+import os
+import signal
+import threading
+import time
+import numpy as np
+
+def make_jobs(n, seed):
+    """
+    Games between the two stock AIs on one map
+    """
+    map_seed, game_seed = lch.spawn_seeds(seed, 2)
+    return [lch.GameJob(map_seed, (12, 8), ('8f74e6', '8f0bbc'), ('6edfda', 'e8c2c8'), s)
+            for s in lch.spawn_seeds(game_seed, n)]
+
+def hung(*args):
+    raise RuntimeError('Batch hung after the worker was killed')
+
+def main():
+    parser = argparse.ArgumentParser(description=('Kills WorkerPool workers partway through '
+        'a batch and checks that the batch still finishes, with the same results as '
+        'playing the jobs in this process'))
+    parser.add_argument('--workers', default=2, type=int)
+    parser.add_argument('--jobs', default=8, type=int)
+    parser.add_argument('--kill-after', default=2.5, type=float,
+            help='Seconds between kills, the first one this far into the batch')
+    parser.add_argument('--kills', default=3, type=int,
+            help='How many times to kill a worker, taking turns between them')
+    parser.add_argument('--consumer-delay', default=3., type=float,
+            help=('Seconds to spend on each result, like the trainer does, so messages from '
+                'the workers pile up'))
+    parser.add_argument('--timeout', default=120, type=float,
+            help='Seconds to wait for the batch before calling it hung')
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.jobs, np.random.SeedSequence(0))
+    expected = [lch.run_job(job)[0] for job in jobs]
+    pool = lch.WorkerPool(args.workers)
+    killed = []
+    stop = threading.Event()
+    def killer():
+        for i in range(args.kills):
+            if stop.wait(args.kill_after):
+                return
+            proc = pool.procs[i % args.workers]
+            killed.append(proc.pid)
+            os.kill(proc.pid, signal.SIGKILL)
+    threading.Thread(target=killer, daemon=True).start()
+    try:
+        signal.signal(signal.SIGALRM, hung)
+        signal.alarm(int(args.timeout))
+        results = [None]*len(jobs)
+        start = time.perf_counter()
+        for job_i, (result, _, _) in pool.imap_unordered(jobs):
+            results[job_i] = result
+            time.sleep(args.consumer_delay)
+        signal.alarm(0)
+        assert results == expected, f'{results} != {expected}'
+    finally:
+        stop.set()
+        pool.close()
+    print(f'{len(killed)} workers killed, batch of {len(jobs)} finished in '
+          f'{time.perf_counter() - start:.1f} s with the right results')
+
+if __name__ == '__main__':
+    main()